@@ -0,0 +1,446 @@
+import argparse
+import json
+import math
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from compute_market_data import (
+    AGG_COLUMNS,
+    aggregate_trade_bars,
+    compute_market_data_parallel,
+    fill_vol,
+    retrieve_order_data,
+)
+from book_set import BookSet
+from data_io import EPOCH_OFFSET, PAIRS, build_cache, read_chunks
+from find_arbitrage import ArbitrageScanner
+from order_book import BOOK_BACKENDS, create_order_book
+from price_encoding import get_encoding
+
+# value of each currency in USD used to center the prices of the synthetic pairs, extra currencies get their own value
+CURRENCY_VALUES = {"USD": 1.0, "EUR": 1.1, "BTC": 10000.0, "BCH": 300.0}
+
+# percentiles reported for latencies
+PERCENTILES = [50, 90, 99, 99.9]
+
+
+def make_pairs(num_pairs):
+    """
+    Name num_pairs pairs, the default pairs first, followed by extra currencies traded against USD and BTC so that
+    they form more arbitrage cycles.
+
+    :param num_pairs: number of pairs
+    :type num_pairs: int
+    :return: pair names of two currencies
+    :rtype: list
+    """
+    pairs = PAIRS[:num_pairs]
+    for i in range(num_pairs - len(pairs)):
+        pairs.append("X{}-{}".format(i // 2, "USD" if i % 2 == 0 else "BTC"))
+    return pairs
+
+
+def currency_value(currency):
+    """
+    Return the value in USD of a currency of the synthetic market.
+
+    :param currency: currency name
+    :type currency: str
+    :return: value in USD
+    :rtype: float
+    """
+    if currency in CURRENCY_VALUES:
+        return CURRENCY_VALUES[currency]
+    # extra currencies X0, X1, ... are worth 10, 20, ... USD
+    return 10.0 * (int(currency[1:]) + 1)
+
+
+def sweep_levels(mid_ticks, price_ticks, cancels):
+    """
+    Find the levels of the book of one pair that its midpoint moves past, so that they can be cancelled before the
+    book crosses. Each message places or cancels a bid below the midpoint or an ask above it, and all bids at or above
+    and all asks at or below the new midpoint are cancelled before it, which keeps the best bid below the midpoint and
+    the best ask above it.
+
+    :param mid_ticks: midpoint in ticks at each message
+    :type mid_ticks: numpy.ndarray
+    :param price_ticks: price in ticks of each message
+    :type price_ticks: numpy.ndarray
+    :param cancels: whether each message cancels its level
+    :type cancels: numpy.ndarray
+    :return: index of the message each cancel goes before, and price in ticks of the cancelled level
+    :rtype: numpy.ndarray, numpy.ndarray
+    """
+    bids = set()
+    asks = set()
+    positions = []
+    swept_ticks = []
+    previous_mid = mid_ticks[0] if len(mid_ticks) else 0
+    for position, (mid, price, cancel) in enumerate(zip(mid_ticks.tolist(), price_ticks.tolist(), cancels.tolist())):
+        # all bids are below and all asks above the previous midpoint, only the ticks it moved over can be crossed
+        if mid < previous_mid:
+            swept = [level for level in range(mid, previous_mid) if level in bids]
+            bids.difference_update(swept)
+        else:
+            swept = [level for level in range(previous_mid + 1, mid + 1) if level in asks]
+            asks.difference_update(swept)
+        positions.extend([position] * len(swept))
+        swept_ticks.extend(swept)
+        previous_mid = mid
+        side = bids if price < mid else asks
+        if cancel:
+            side.discard(price)
+        else:
+            side.add(price)
+    return np.array(positions, dtype=np.int64), np.array(swept_ticks, dtype=np.int64)
+
+
+def generate_market_data(
+    num_pairs=5,
+    depth=50,
+    num_messages=200000,
+    message_rate=1000.0,
+    cancel_ratio=0.4,
+    trade_ratio=0.05,
+    volatility=1e-4,
+    seed=0,
+):
+    """
+    Generate synthetic L2 book updates and trades in the layout of book.csv and trades.csv. The midpoint of each pair
+    follows a random walk around a price consistent with the other pairs. A message sets the size of a level up to
+    depth ticks from the midpoint, on the bid side below and the ask side above it, or cancels a level with amount 0.
+    Messages arrive as a Poisson process at message_rate per second from 0:00:00 8/16/19 UTC. Levels the midpoint
+    moves past are cancelled with amount 0 right before the message that moves it, see sweep_levels, so the books
+    never cross and the book data holds these cancels on top of num_messages.
+
+    :param num_pairs: number of pairs, see make_pairs
+    :type num_pairs: int
+    :param depth: number of ticks from the midpoint levels are placed at
+    :type depth: int
+    :param num_messages: number of book updates over all pairs
+    :type num_messages: int
+    :param message_rate: book updates per second over all pairs
+    :type message_rate: float
+    :param cancel_ratio: share of book updates that cancel a level
+    :type cancel_ratio: float
+    :param trade_ratio: number of trades per book update
+    :type trade_ratio: float
+    :param volatility: standard deviation of the log midpoint change per message of a pair
+    :type volatility: float
+    :param seed: seed of the random generator
+    :type seed: int
+    :return: book data and trade data with columns pair, price, amount, servert
+    :rtype: pandas.DataFrame, pandas.DataFrame
+    """
+    rng = np.random.RandomState(seed)
+    pairs = make_pairs(num_pairs)
+    servert = EPOCH_OFFSET + np.cumsum(rng.exponential(1000000 / message_rate, num_messages)).astype(np.int64)
+    pair_codes = rng.randint(num_pairs, size=num_messages)
+    sizes = rng.lognormal(0, 1, num_messages).round(8)
+    cancels = rng.rand(num_messages) < cancel_ratio
+    prices = np.empty(num_messages)
+    mids = np.empty(num_messages)
+    amounts = np.empty(num_messages)
+    # cancels of levels the midpoint moved past: index of the message they go before, pair code, and price
+    sweeps = []
+    for pair_code, pair in enumerate(pairs):
+        in_pair = np.flatnonzero(pair_codes == pair_code)
+        base, quote = pair.split("-")
+        mid = currency_value(base) / currency_value(quote)
+        # prices are on a grid of 5 significant digits, or on the tick size of the pair if it is coarser
+        decimals = min(
+            max(0, 4 - int(math.floor(math.log10(mid)))), int(round(math.log10(get_encoding(pair).ticks_per_unit)))
+        )
+        tick = 10.0 ** -decimals
+        mids[in_pair] = mid * np.exp(np.cumsum(rng.normal(0, volatility, len(in_pair))))
+        mid_ticks = np.round(mids[in_pair] / tick).astype(np.int64)
+        offsets = rng.randint(1, depth + 1, size=len(in_pair)) * rng.choice([-1, 1], size=len(in_pair))
+        prices[in_pair] = np.round((mid_ticks + offsets) * tick, decimals)
+        # bids are placed below the midpoint with a positive amount, asks above it with a negative amount
+        amounts[in_pair] = np.where(offsets < 0, sizes[in_pair], -sizes[in_pair])
+        positions, swept_ticks = sweep_levels(mid_ticks, mid_ticks + offsets, cancels[in_pair])
+        sweeps.append((in_pair[positions], np.full(len(positions), pair_code), np.round(swept_ticks * tick, decimals)))
+    amounts[cancels] = 0.0
+    sweep_rows, sweep_codes, sweep_prices = (np.concatenate(values) for values in zip(*sweeps))
+    # each sweep goes right before its message, with the same servert
+    rows = np.concatenate([np.arange(num_messages), sweep_rows])
+    order = np.lexsort((np.concatenate([np.ones(num_messages), np.zeros(len(sweep_rows))]), rows))
+    book_data = pd.DataFrame(
+        {
+            "pair": np.array(pairs)[np.concatenate([pair_codes, sweep_codes])[order]],
+            "price": np.concatenate([prices, sweep_prices])[order],
+            "amount": np.concatenate([amounts, np.zeros(len(sweep_rows))])[order],
+            "servert": servert[rows[order]],
+        }
+    )
+
+    # trades happen at the midpoint of random messages, buys with a positive and sells with a negative amount
+    trade_rows = np.sort(rng.choice(num_messages, int(num_messages * trade_ratio), replace=False))
+    trade_data = pd.DataFrame(
+        {
+            "pair": np.array(pairs)[pair_codes[trade_rows]],
+            "price": mids[trade_rows],
+            "amount": rng.lognormal(-2, 1, len(trade_rows)) * rng.choice([-1, 1], size=len(trade_rows)),
+            "servert": servert[trade_rows],
+        }
+    )
+    return book_data, trade_data
+
+
+def measure(func, trace_memory=True):
+    """
+    Time one call of func, and measure its peak memory allocated in a second call traced by tracemalloc, so that
+    tracing does not slow down the timed call.
+
+    :param func: function without arguments
+    :type func: Callable
+    :param trace_memory: whether peak memory is measured
+    :type trace_memory: bool
+    :return: seconds taken and peak memory in bytes (None if not measured), and the result of the timed call
+    :rtype: dict, Any
+    """
+    start = time.perf_counter()
+    result = func()
+    stats = {"seconds": time.perf_counter() - start, "peak_memory_bytes": None}
+    if trace_memory:
+        tracemalloc.start()
+        func()
+        stats["peak_memory_bytes"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return stats, result
+
+
+def summarize_latencies(latencies_ns):
+    """
+    Summarize latencies in microseconds.
+
+    :param latencies_ns: latencies in nanoseconds
+    :type latencies_ns: numpy.ndarray
+    :return: mean, percentiles, and maximum
+    :rtype: dict
+    """
+    latencies_us = latencies_ns / 1000
+    summary = {"mean_us": float(latencies_us.mean()), "max_us": float(latencies_us.max())}
+    for percentile, value in zip(PERCENTILES, np.percentile(latencies_us, PERCENTILES).tolist()):
+        summary["p{}_us".format(percentile)] = value
+    return summary
+
+
+def benchmark_order_book(book_data, backend, trace_memory=True):
+    """
+    Replay book data through one order book per pair. Per message latencies of update_order and get_liquidity are
+    timed one call at a time, throughput is measured separately with apply_updates.
+
+    :param book_data: book data with columns pair, price, amount, servert
+    :type book_data: pandas.DataFrame
+    :param backend: name of the order book backend, see order_book.BOOK_BACKENDS
+    :type backend: str
+    :param trace_memory: whether peak memory is measured
+    :type trace_memory: bool
+    :return: latencies, throughput, and peak memory of the replay
+    :rtype: dict
+    """
+    books = BookSet(book_data["pair"].unique(), backend)
+    codes, price_ticks, amount_lots = books.encode_chunk(book_data)
+    prices = price_ticks.tolist()
+    amounts = amount_lots.tolist()
+    clock = time.perf_counter_ns
+
+    update_latencies = np.empty(len(prices), dtype=np.int64)
+    liquidity_latencies = np.empty(len(prices), dtype=np.int64)
+    for i, (code, price, amount) in enumerate(zip(codes.tolist(), prices, amounts)):
+        book = books.books[code]
+        start = clock()
+        book.update_order(price, amount)
+        middle = clock()
+        book.get_liquidity()
+        liquidity_latencies[i] = clock() - middle
+        update_latencies[i] = middle - start
+
+    def replay():
+        replay_books = {}
+        for pair, pair_data in book_data.groupby("pair", sort=False):
+            encoding = get_encoding(pair)
+            replay_books[pair] = create_order_book(backend)
+            prices = encoding.encode_prices(pair_data["price"].to_numpy())
+            replay_books[pair].apply_updates(prices, encoding.encode_sizes(pair_data["amount"].to_numpy()))
+        return replay_books
+
+    stats, _ = measure(replay, trace_memory)
+    stats["messages_per_second"] = len(prices) / stats["seconds"]
+    stats["update_order"] = summarize_latencies(update_latencies)
+    stats["get_liquidity"] = summarize_latencies(liquidity_latencies)
+    snapshots = [book.to_arrays() for book in books.books]
+    stats["price_levels"] = sum(len(arrays["bid_prices"]) + len(arrays["ask_prices"]) for arrays in snapshots)
+    return stats
+
+
+def benchmark_market_data(book_path, trade_path, pairs, cache_dir, max_workers=None, trace_memory=True):
+    """
+    Time compute_market_data end to end, streamed from the csv files in one process, and from binary caches with one
+    worker process per pair.
+
+    :param book_path: csv file of book data
+    :type book_path: str
+    :param trade_path: csv file of trade data
+    :type trade_path: str
+    :param pairs: pair names of two currencies
+    :type pairs: list
+    :param cache_dir: directory the binary caches are built in
+    :type cache_dir: str
+    :param max_workers: number of worker processes, None for the number of cpus
+    :type max_workers: int
+    :param trace_memory: whether peak memory is measured
+    :type trace_memory: bool
+    :return: time and peak memory of each stage
+    :rtype: dict
+    """
+
+    def stream():
+        trade_bars = aggregate_trade_bars(pd.DataFrame(columns=AGG_COLUMNS), read_chunks(trade_path, pairs), pairs)
+        return {
+            pair: fill_vol(retrieve_order_data(read_chunks(book_path, pairs), pair, trade_bars[pair]))
+            for pair in pairs
+        }
+
+    book_cache = os.path.join(cache_dir, "book")
+    trade_cache = os.path.join(cache_dir, "trades")
+
+    def build():
+        build_cache(book_path, book_cache, pairs)
+        build_cache(trade_path, trade_cache, pairs)
+
+    results = {"stream": measure(stream, trace_memory)[0], "build_cache": measure(build, trace_memory)[0]}
+    # peak memory of the parallel stage is spread over the worker processes, which tracemalloc does not see
+    results["parallel"] = measure(
+        lambda: compute_market_data_parallel(book_cache, trade_cache, pairs, max_workers=max_workers), False
+    )[0]
+    return results
+
+
+def benchmark_arbitrage(book_path, pairs, backend, trace_memory=True):
+    """
+    Time the arbitrage replay of find_arbitrage over a csv file of book data.
+
+    :param book_path: csv file of book data
+    :type book_path: str
+    :param pairs: pair names of two currencies
+    :type pairs: list
+    :param backend: name of the order book backend, see order_book.BOOK_BACKENDS
+    :type backend: str
+    :param trace_memory: whether peak memory is measured
+    :type trace_memory: bool
+    :return: time, peak memory, throughput, and number of opportunities of the replay
+    :rtype: dict
+    """
+
+    def replay():
+        books = BookSet(pairs, backend)
+        scanner = ArbitrageScanner(books)
+        num_messages = 0
+        for book_chunk in read_chunks(book_path, pairs, epoch_offset=0):
+            codes, price_ticks, amount_lots = books.encode_chunk(book_chunk)
+            for code, price, amount, servert in zip(
+                codes.tolist(), price_ticks.tolist(), amount_lots.tolist(), book_chunk["servert"].tolist()
+            ):
+                scanner.update(code, price, amount, servert)
+            num_messages += len(book_chunk)
+        return num_messages, len(scanner.recorder)
+
+    stats, (num_messages, num_opportunities) = measure(replay, trace_memory)
+    stats["messages_per_second"] = num_messages / stats["seconds"]
+    stats["opportunities"] = num_opportunities
+    return stats
+
+
+def describe_environment():
+    """
+    Describe the environment of a benchmark run, so that runs across commits and machines can be told apart.
+
+    :return: commit, python, numpy, and pandas versions, and machine
+    :rtype: dict
+    """
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True
+        ).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "commit": commit or None,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "machine": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def run_benchmarks(config, trace_memory=True, max_workers=None):
+    """
+    Generate a synthetic market and run all benchmarks on it.
+
+    :param config: keyword arguments of generate_market_data
+    :type config: dict
+    :param trace_memory: whether peak memory is measured
+    :type trace_memory: bool
+    :param max_workers: number of worker processes of the parallel market data stage, None for the number of cpus
+    :type max_workers: int
+    :return: configuration, environment, and results of every benchmark
+    :rtype: dict
+    """
+    book_data, trade_data = generate_market_data(**config)
+    pairs = make_pairs(config.get("num_pairs", 5))
+    results = {"order_book": {}, "arbitrage": {}}
+    for backend in BOOK_BACKENDS:
+        results["order_book"][backend] = benchmark_order_book(book_data, backend, trace_memory)
+    with tempfile.TemporaryDirectory() as data_dir:
+        book_path = os.path.join(data_dir, "book.csv")
+        trade_path = os.path.join(data_dir, "trades.csv")
+        book_data.to_csv(book_path, index=False)
+        trade_data.to_csv(trade_path, index=False)
+        results["market_data"] = benchmark_market_data(
+            book_path, trade_path, pairs, os.path.join(data_dir, "cache"), max_workers, trace_memory
+        )
+        for backend in BOOK_BACKENDS:
+            results["arbitrage"][backend] = benchmark_arbitrage(book_path, pairs, backend, trace_memory)
+    return {"config": config, "environment": describe_environment(), "results": results}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark order books, market data aggregation, and arbitrage.")
+    parser.add_argument("--pairs", type=int, default=5, help="number of pairs")
+    parser.add_argument("--depth", type=int, default=50, help="number of ticks from the midpoint levels are placed at")
+    parser.add_argument("--messages", type=int, default=200000, help="number of book updates")
+    parser.add_argument("--rate", type=float, default=1000.0, help="book updates per second")
+    parser.add_argument("--cancel-ratio", type=float, default=0.4, help="share of book updates that cancel a level")
+    parser.add_argument("--trade-ratio", type=float, default=0.05, help="number of trades per book update")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the random generator")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes of the parallel stage")
+    parser.add_argument("--no-memory", action="store_true", help="skip the peak memory measurements")
+    parser.add_argument("--output", default=None, help="json file the results are written to")
+    args = parser.parse_args()
+
+    benchmark_config = {
+        "num_pairs": args.pairs,
+        "depth": args.depth,
+        "num_messages": args.messages,
+        "message_rate": args.rate,
+        "cancel_ratio": args.cancel_ratio,
+        "trade_ratio": args.trade_ratio,
+        "seed": args.seed,
+    }
+    report = run_benchmarks(benchmark_config, not args.no_memory, args.workers)
+    output_path = args.output or "./benchmark_output/{}.json".format(time.strftime("%Y%m%d-%H%M%S"))
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    with open(output_path, "w") as output_file:
+        json.dump(report, output_file, indent=2)
+    print(json.dumps(report["results"], indent=2))
+    print("Results written to {}.".format(output_path))
@@ -0,0 +1,168 @@
+import argparse
+import json
+import os
+
+import numpy as np
+
+from book_set import BookSet
+from data_io import load_cache_meta, load_pair_arrays
+from order_book import create_order_book
+
+
+def save_checkpoint(path, books):
+    """
+    Write the order books of all pairs to one binary snapshot file holding the price levels of both sides in ticks
+    and lots.
+
+    :param path: path of the .npz snapshot file
+    :type path: str
+    :param books: order books of the pairs
+    :type books: book_set.BookSet
+    :return: None
+    :rtype: NoneType
+    """
+    arrays = {"pairs": np.array(list(books))}
+    for pair, book in books.items():
+        for side, values in book.to_arrays().items():
+            arrays[pair + "/" + side] = values
+    np.savez(path, **arrays)
+
+
+def load_checkpoint(path, backend="rbtree", pairs=None):
+    """
+    Restore the order books of all pairs, or of some of them, from a snapshot file written by save_checkpoint.
+
+    :param path: path of the .npz snapshot file
+    :type path: str
+    :param backend: name of the order book backend, see order_book.BOOK_BACKENDS
+    :type backend: str
+    :param pairs: pair names of two currencies to restore, None for all pairs of the snapshot
+    :type pairs: list
+    :return: order books of the pairs, with pair codes in the order of pairs, or in the order they were saved
+    :rtype: book_set.BookSet
+    """
+    # create_order_book rejects unknown backends
+    book_class = type(create_order_book(backend))
+    with np.load(path) as snapshot:
+        pairs = snapshot["pairs"].tolist() if pairs is None else list(pairs)
+        if pairs and not np.issubdtype(snapshot[pairs[0] + "/bid_prices"].dtype, np.integer):
+            raise ValueError("Checkpoint {} holds decimal prices, rebuild it in ticks and lots.".format(path))
+        books = {
+            pair: book_class.from_arrays(
+                snapshot[pair + "/bid_prices"],
+                snapshot[pair + "/bid_sizes"],
+                snapshot[pair + "/ask_prices"],
+                snapshot[pair + "/ask_sizes"],
+            )
+            for pair in pairs
+        }
+    return BookSet(pairs, books=books)
+
+
+def build_checkpoints(cache_dir, checkpoint_dir, interval, pairs=None, epoch_offset=0, backend="rbtree"):
+    """
+    Replay the order books of a binary cache of book data and save a snapshot of all books every interval, at the
+    multiples of interval from epoch_offset. The books of different pairs are independent, so each one is replayed
+    straight from its own partition of the cache, encoded to the ticks and lots of the pair.
+
+    :param cache_dir: directory of the binary cache of book data
+    :type cache_dir: str
+    :param checkpoint_dir: directory the snapshots are written to
+    :type checkpoint_dir: str
+    :param interval: time between two checkpoints in microseconds
+    :type interval: int
+    :param pairs: pair names of two currencies, None for all pairs of the cache
+    :type pairs: list
+    :param epoch_offset: time subtracted from the original servert, in microseconds
+    :type epoch_offset: int
+    :param backend: name of the order book backend used for the replay
+    :type backend: str
+    :return: None
+    :rtype: NoneType
+    """
+    pairs = load_cache_meta(cache_dir)["pairs"] if pairs is None else list(pairs)
+    pair_arrays = {pair: load_pair_arrays(cache_dir, pair, epoch_offset) for pair in pairs}
+    first_time = min((arrays["servert"][0] for arrays in pair_arrays.values() if len(arrays["servert"])), default=0)
+    last_time = max((arrays["servert"][-1] for arrays in pair_arrays.values() if len(arrays["servert"])), default=0)
+    # a checkpoint holds every order at or before its time, none is needed after the last order
+    checkpoint_times = np.arange((first_time // interval + 1) * interval, last_time, interval, dtype=np.int64)
+    save_checkpoints(cache_dir, checkpoint_dir, checkpoint_times, pairs, epoch_offset, backend)
+
+
+def save_checkpoints(cache_dir, checkpoint_dir, checkpoint_times, pairs=None, epoch_offset=0, backend="rbtree"):
+    """
+    Replay the order books of a binary cache of book data and save a snapshot of all books at each of the given
+    times, in one pass over the cache. Each snapshot holds every order at or before its time.
+
+    :param cache_dir: directory of the binary cache of book data
+    :type cache_dir: str
+    :param checkpoint_dir: directory the snapshots are written to
+    :type checkpoint_dir: str
+    :param checkpoint_times: times of the snapshots in ascending order, in microseconds from epoch_offset
+    :type checkpoint_times: Iterable[int]
+    :param pairs: pair names of two currencies, None for all pairs of the cache
+    :type pairs: list
+    :param epoch_offset: time subtracted from the original servert, in microseconds
+    :type epoch_offset: int
+    :param backend: name of the order book backend used for the replay
+    :type backend: str
+    :return: None
+    :rtype: NoneType
+    """
+    pairs = load_cache_meta(cache_dir)["pairs"] if pairs is None else list(pairs)
+    pair_arrays = {pair: load_pair_arrays(cache_dir, pair, epoch_offset) for pair in pairs}
+    checkpoint_times = np.asarray(checkpoint_times, dtype=np.int64)
+
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    books = BookSet(pairs, backend)
+    positions = dict.fromkeys(pairs, 0)
+    for checkpoint_index, checkpoint_time in enumerate(checkpoint_times):
+        for pair, arrays in pair_arrays.items():
+            stop = int(np.searchsorted(arrays["servert"], checkpoint_time, side="right"))
+            code = books.codes[pair]
+            encoding = books.encodings[code]
+            books.apply_updates(
+                code,
+                encoding.encode_prices(arrays["price"][positions[pair] : stop]),
+                encoding.encode_sizes(arrays["amount"][positions[pair] : stop]),
+            )
+            positions[pair] = stop
+        save_checkpoint(checkpoint_path(checkpoint_dir, checkpoint_index), books)
+    with open(os.path.join(checkpoint_dir, "meta.json"), "w") as meta_file:
+        json.dump({"pairs": pairs, "epoch_offset": epoch_offset, "times": checkpoint_times.tolist()}, meta_file)
+
+
+def load_checkpoint_meta(checkpoint_dir):
+    """
+    Load the description of a directory of checkpoints.
+
+    :param checkpoint_dir: directory of the snapshots
+    :type checkpoint_dir: str
+    :return: pairs, epoch offset of servert, and time of each checkpoint
+    :rtype: dict
+    """
+    with open(os.path.join(checkpoint_dir, "meta.json")) as meta_file:
+        return json.load(meta_file)
+
+
+def checkpoint_path(checkpoint_dir, checkpoint_index):
+    """
+    Return the path of a snapshot file in a directory of checkpoints.
+
+    :param checkpoint_dir: directory of the snapshots
+    :type checkpoint_dir: str
+    :param checkpoint_index: index of the checkpoint in time order
+    :type checkpoint_index: int
+    :return: path of the snapshot file
+    :rtype: str
+    """
+    return os.path.join(checkpoint_dir, "{}.npz".format(checkpoint_index))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Save order book checkpoints of a binary cache of book data.")
+    parser.add_argument("cache_dir", help="directory of the binary cache of book data")
+    parser.add_argument("checkpoint_dir", help="directory the checkpoints are written to")
+    parser.add_argument("--interval", type=float, default=3600, help="seconds between two checkpoints")
+    args = parser.parse_args()
+    build_checkpoints(args.cache_dir, args.checkpoint_dir, int(args.interval * 1000000))
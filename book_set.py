@@ -0,0 +1,143 @@
+import numpy as np
+import pandas as pd
+
+from order_book import create_order_book
+from price_encoding import encode_rows, get_encoding
+
+
+class BookSet:
+    def __init__(self, pairs, backend="rbtree", books=None):
+        """
+        Instantiate BookSet object which holds the order books of several pairs under integer pair codes, the position
+        of each pair in pairs. Updates are routed to a book by its code, and the decoded best bid and best ask of every
+        pair are kept in one array, so that consumers read the top of book of all pairs at once.
+
+        :param pairs: pair names of two currencies
+        :type pairs: list
+        :param backend: name of the order book backend of new books, see order_book.BOOK_BACKENDS
+        :type backend: str
+        :param books: existing order books keyed by pair name, None to create empty books
+        :type books: dict
+        """
+        self.pairs = list(pairs)
+        self.codes = {pair: code for code, pair in enumerate(self.pairs)}
+        if books is None:
+            self.books = [create_order_book(backend) for _ in self.pairs]
+        else:
+            self.books = [books[pair] for pair in self.pairs]
+        self.encodings = [get_encoding(pair) for pair in self.pairs]
+        # best bid and best ask of each pair as decimals, one row per pair code, NaN while a side is empty
+        self.top_of_book = np.full((len(self.pairs), 2), np.nan)
+        for code in range(len(self.pairs)):
+            self._set_top(code)
+
+    def __len__(self):
+        """
+        Return the number of pairs.
+
+        :return: number of pairs
+        :rtype: int
+        """
+        return len(self.pairs)
+
+    def __iter__(self):
+        """
+        Iterate over the pair names in the order of their codes.
+
+        :return: pair names
+        :rtype: Iterator[str]
+        """
+        return iter(self.pairs)
+
+    def __getitem__(self, pair):
+        """
+        Return the order book of a pair.
+
+        :param pair: pair name of two currencies
+        :type pair: str
+        :return: the order book of the pair
+        :rtype: order_book.BaseOrderBook
+        """
+        return self.books[self.codes[pair]]
+
+    def items(self):
+        """
+        Iterate over the pairs with their order books, in the order of their codes.
+
+        :return: pair name and order book of each pair
+        :rtype: Iterator[tuple]
+        """
+        return zip(self.pairs, self.books)
+
+    def get_codes(self, pairs):
+        """
+        Factorize a column of pair names into pair codes once, so that its rows are routed by index.
+
+        :param pairs: pair name of each row, categorical or not
+        :type pairs: pandas.Series
+        :return: pair code of each row, -1 for pairs outside the set
+        :rtype: numpy.ndarray
+        """
+        return np.asarray(pd.Categorical(pairs, categories=self.pairs).codes, dtype=np.int64)
+
+    def encode_chunk(self, chunk):
+        """
+        Factorize the pairs of a chunk of book data and encode its prices and amounts to the ticks and lots of each
+        row's pair.
+
+        :param chunk: chunk with columns pair, price, amount, e.g. as returned by data_io.read_chunks
+        :type chunk: pandas.DataFrame
+        :return: pair codes, prices in ticks, and amounts in lots
+        :rtype: numpy.ndarray, numpy.ndarray, numpy.ndarray
+        """
+        codes = self.get_codes(chunk["pair"])
+        price_ticks, amount_lots = encode_rows(chunk["price"], chunk["amount"], codes, self.encodings)
+        return codes, price_ticks, amount_lots
+
+    def update(self, code, price, amount):
+        """
+        Update the order book of a pair, and its row of top_of_book if its best bid or best ask changed.
+
+        :param code: pair code
+        :type code: int
+        :param price: price of a limit order in ticks of the pair
+        :type price: int
+        :param amount: amount of the limit order in lots of the pair
+        :type amount: int
+        :return: True iff the best bid or best ask price changed
+        :rtype: bool
+        """
+        top_changed = self.books[code].update_order(price, amount)
+        if top_changed:
+            self._set_top(code)
+        return top_changed
+
+    def apply_updates(self, code, prices, amounts):
+        """
+        Apply a block of updates to the order book of a pair with order_book.BaseOrderBook.apply_updates, and refresh
+        its row of top_of_book.
+
+        :param code: pair code
+        :type code: int
+        :param prices: prices of the limit orders in ticks of the pair
+        :type prices: numpy.ndarray
+        :param amounts: amounts of the limit orders in lots of the pair
+        :type amounts: numpy.ndarray
+        :return: None
+        :rtype: NoneType
+        """
+        self.books[code].apply_updates(prices, amounts)
+        self._set_top(code)
+
+    def _set_top(self, code):
+        """
+        Copy the decoded best bid and best ask of a pair into top_of_book.
+
+        :param code: pair code
+        :type code: int
+        :return: None
+        :rtype: NoneType
+        """
+        book = self.books[code]
+        encoding = self.encodings[code]
+        self.top_of_book[code] = encoding.decode_prices(book.bid_max), encoding.decode_prices(book.ask_min)
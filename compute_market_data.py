@@ -1,109 +1,537 @@
+import logging
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
 import pandas as pd
 import numpy as np
-import math
 
-from order_book import OrderBook
+import metrics
+from book_checkpoint import checkpoint_path, load_checkpoint, save_checkpoints
+from data_io import EPOCH_OFFSET, PAIRS, build_cache, load_pair_arrays
+from order_book import create_order_book
+from price_encoding import DEFAULT_ENCODING, get_encoding
+
+logger = logging.getLogger(__name__)
+
+# width of one aggregation bar and length of the aggregated session, in microseconds
+BAR_WIDTH = 60000000
+SESSION_LENGTH = 480 * BAR_WIDTH
+
+# columns of the aggregated market information
+AGG_COLUMNS = [
+    "time_period",
+    "period_end_time",
+    "high",
+    "low",
+    "last",
+    "volume",
+    "spread",
+    "midpoint",
+    "liquidity_bid",
+    "liquidity_ask",
+    "volatility_mid_1min",
+    "volatility_mid_3min",
+    "volatility_last_1min",
+    "volatility_last_3min",
+]
+
+# number of values reduced at a time by rolling_std
+ROLLING_BLOCK_SIZE = 1 << 20
+
+# volatility columns with the price type, return interval (in bars), and number of periods they are computed from
+VOL_COLUMNS = {
+    "volatility_mid_1min": ("midpoint", 1, 10),
+    "volatility_mid_3min": ("midpoint", 3, 10),
+    "volatility_last_1min": ("last", 1, 10),
+    "volatility_last_3min": ("last", 3, 10),
+}
+
 
+class TradeBarAggregator:
+    def __init__(self, pairs, bar_width=BAR_WIDTH, session_length=SESSION_LENGTH):
+        """
+        Instantiate TradeBarAggregator object which reduces trade data to bar level high price, low price, last price,
+        and volume traded for all pairs. Trades can be added in chunks, the statistics of each chunk are merged into
+        one table of at most one row per pair and bar.
 
-def aggregate_trade_data(agg_data, trade_data, pair):
+        :param pairs: pair names of two currencies to aggregate
+        :type pairs: list
+        :param bar_width: width of a bar in microseconds
+        :type bar_width: int
+        :param session_length: length of the session in microseconds, trades after the session end are ignored
+        :type session_length: int
+        """
+        self.pairs = list(pairs)
+        self.num_bars = int(session_length // bar_width)
+        self.bar_width = bar_width
+        self.end_time_arr = bar_width * np.arange(1, self.num_bars + 1, dtype=np.int64)
+        self.bar_stats = None
+        self.seed_stats = None
+
+    def seed(self, trade_data):
+        """
+        Seed the aggregator with trades before the session start. The high, low, and last price of the last bar
+        holding any of them are carried into the empty bars at the start of the session, as if the session continued
+        the one before it. Only trades of the last bar_width before the last trade of a pair matter.
+
+        :param trade_data: data of traded orders before the session start
+        :type trade_data: pandas.DataFrame
+        :return: None
+        :rtype: NoneType
+        """
+        trade_data = trade_data.loc[trade_data["pair"].isin(self.pairs)].sort_values(by=["servert"], kind="mergesort")
+        # bars before the session count back from 0:00:00, bar -1 covers (-bar_width, 0]
+        servert = trade_data["servert"].to_numpy()
+        bar_index = -(-servert // self.bar_width) - 1
+        self.seed_stats = (
+            pd.DataFrame(
+                {
+                    "pair": np.asarray(trade_data["pair"], dtype=object),
+                    "bar": bar_index,
+                    "price": trade_data["price"].to_numpy(),
+                }
+            )
+            .groupby(["pair", "bar"])
+            .agg(high=("price", "max"), low=("price", "min"), last=("price", "last"))
+            .groupby(level="pair")
+            .last()
+        )
+
+    def add(self, trade_data):
+        """
+        Add a chunk of trade data. Trades are assigned to bars with np.searchsorted on servert and reduced with one
+        groupby over pair and bar.
+
+        :param trade_data: data of traded orders, chunks are added in file order
+        :type trade_data: pandas.DataFrame
+        :return: None
+        :rtype: NoneType
+        """
+        # stable sort keeps the file order of trades sharing a servert, the last row of each group is the last trade
+        trade_data = trade_data.loc[trade_data["pair"].isin(self.pairs)].sort_values(by=["servert"], kind="mergesort")
+        # bar i covers (end_time_arr[i - 1], end_time_arr[i]], the first bar also captures orders just before 0:00:00
+        bar_index = np.searchsorted(self.end_time_arr, trade_data["servert"].to_numpy(), side="left")
+        in_session = bar_index < self.num_bars
+        chunk_stats = (
+            pd.DataFrame(
+                {
+                    "pair": np.asarray(trade_data["pair"], dtype=object)[in_session],
+                    "bar": bar_index[in_session],
+                    "price": trade_data["price"].to_numpy()[in_session],
+                    "servert": trade_data["servert"].to_numpy()[in_session],
+                    "volume": np.abs(trade_data["amount"].to_numpy()[in_session]),
+                }
+            )
+            .groupby(["pair", "bar"], sort=False)
+            .agg(
+                high=("price", "max"),
+                low=("price", "min"),
+                last=("price", "last"),
+                last_time=("servert", "last"),
+                volume=("volume", "sum"),
+            )
+        )
+        if self.bar_stats is None:
+            self.bar_stats = chunk_stats
+        else:
+            # merge with the bars of earlier chunks, the last trade of a bar is the one with the latest servert
+            self.bar_stats = (
+                pd.concat([self.bar_stats, chunk_stats])
+                .sort_values(by=["last_time"], kind="mergesort")
+                .groupby(level=["pair", "bar"], sort=False)
+                .agg(
+                    high=("high", "max"),
+                    low=("low", "min"),
+                    last=("last", "last"),
+                    last_time=("last_time", "last"),
+                    volume=("volume", "sum"),
+                )
+            )
+
+    def get_bars(self, agg_data):
+        """
+        Build the bars of every pair from the trades added so far. A bar without trades has volume 0 and carries the
+        prices of the previous bar forward.
+
+        :param agg_data: empty placeholder for the data, its columns define the schema of the output
+        :type agg_data: pandas.DataFrame
+        :return: dataframes with high, low, last, volume aggregated, keyed by pair
+        :rtype: dict
+        """
+        bars = {}
+        for pair in self.pairs:
+            if self.bar_stats is not None and pair in self.bar_stats.index.get_level_values("pair"):
+                pair_stats = self.bar_stats.xs(pair, level="pair").reindex(np.arange(self.num_bars))
+            else:
+                pair_stats = pd.DataFrame(
+                    index=np.arange(self.num_bars), columns=["high", "low", "last", "volume"], dtype=float
+                )
+            num_empty = int(pair_stats["volume"].isna().sum())
+            if num_empty > 0:
+                logger.info("No trade exists happened for %s in %d of %d periods.", pair, num_empty, self.num_bars)
+            pair_bars = pd.DataFrame(
+                {
+                    "time_period": np.arange(1, self.num_bars + 1, dtype=float),
+                    "period_end_time": self.end_time_arr.astype(float),
+                    # handle the case that no trade happened in a period: carry prices forward and set volume to 0
+                    "high": pair_stats["high"].ffill().to_numpy(),
+                    "low": pair_stats["low"].ffill().to_numpy(),
+                    "last": pair_stats["last"].ffill().to_numpy(),
+                    "volume": pair_stats["volume"].fillna(0).to_numpy(),
+                }
+            )
+            if self.seed_stats is not None and pair in self.seed_stats.index:
+                # empty bars at the start of the session carry the prices of the last bar before it
+                pair_bars = pair_bars.fillna(self.seed_stats.loc[pair, ["high", "low", "last"]].to_dict())
+            bars[pair] = pair_bars.reindex(columns=agg_data.columns)
+        return bars
+
+
+def aggregate_trade_bars(
+    agg_data, trade_data, pairs, bar_width=BAR_WIDTH, session_length=SESSION_LENGTH, seed_data=None
+):
+    """
+    Aggregate data from trade book to bar level high price, low price, last price, and volume traded for all pairs in
+    a single pass.
+
+    :param agg_data: empty placeholder for the data, its columns define the schema of the output
+    :type agg_data: pandas.DataFrame
+    :param trade_data: data of traded orders in the session, or an iterable of chunks of it
+    :type trade_data: pandas.DataFrame or Iterable[pandas.DataFrame]
+    :param pairs: pair names of two currencies to aggregate
+    :type pairs: list
+    :param bar_width: width of a bar in microseconds
+    :type bar_width: int
+    :param session_length: length of the session in microseconds, trades after the session end are ignored
+    :type session_length: int
+    :param seed_data: data of traded orders before the session start whose prices are carried into its first bars, see
+        TradeBarAggregator.seed, None to leave empty first bars NaN
+    :type seed_data: pandas.DataFrame
+    :return: dataframes with high, low, last, volume aggregated, keyed by pair
+    :rtype: dict
+    """
+    aggregator = TradeBarAggregator(pairs, bar_width, session_length)
+    if seed_data is not None:
+        aggregator.seed(seed_data)
+    for trade_chunk in [trade_data] if isinstance(trade_data, pd.DataFrame) else trade_data:
+        aggregator.add(trade_chunk)
+    return aggregator.get_bars(agg_data)
+
+
+def aggregate_trade_data(
+    agg_data, trade_data, pair, bar_width=BAR_WIDTH, session_length=SESSION_LENGTH, seed_data=None
+):
     """
     Aggregate data from trade book to minute level high price, low price, last price, and volume traded.
 
     :param agg_data: empty placeholder for the data
     :type agg_data: pandas.DataFrame
     :param trade_data: data of traded orders in an 8 hour interval
-    :param pair: pandas.DataFrame
+    :type trade_data: pandas.DataFrame
+    :param pair: pair name of two currencies
+    :type pair: str
+    :param bar_width: width of a bar in microseconds
+    :type bar_width: int
+    :param session_length: length of the session in microseconds
+    :type session_length: int
+    :param seed_data: data of traded orders before the session start, see aggregate_trade_bars
+    :type seed_data: pandas.DataFrame
     :return: dataframe with high, low, last, volume aggregated
     :rtype: pandas.DataFrame
     """
-    end_time_lst = [60000000 * n for n in range(1, 481)]
-    # the fist period need to capture orders just before 0:00:00 8/16/19 UTC
-    end_time_lst.insert(0, -math.inf)
-    curr_high = np.nan
-    curr_low = np.nan
-    curr_last = np.nan
-    for i in range(len(end_time_lst) - 1):
-        # select rows based on time defined
-        start_time = end_time_lst[i]
-        end_time = end_time_lst[i + 1]
-        curr_data = trade_data.loc[
-            (trade_data["servert"] > start_time) & (trade_data["servert"] <= end_time) & (trade_data["pair"] == pair)
-        ]
-        curr_data = curr_data.sort_values(by=["servert"])
-        # get trade info for current period
-        try:
-            curr_high = max(curr_data["price"])
-            curr_low = min(curr_data["price"])
-            curr_last = curr_data["price"].iloc[-1]
-            curr_volume = sum(curr_data["amount"].abs())
-        # handle the case that no trade happened in the last 1 minute
-        except ValueError:
-            print("No trade exists happened for {} from {} to {}.".format(pair, str(start_time), str(end_time)))
-            # set volume to 0 and the rest as NA
-            curr_volume = 0
-
-        agg_data = agg_data.append(
+    return aggregate_trade_bars(agg_data, trade_data, [pair], bar_width, session_length, seed_data)[pair]
+
+
+class SnapshotSampler:
+    def __init__(self, sample_times, backend="rbtree", encoding=DEFAULT_ENCODING, order_book=None):
+        """
+        Instantiate SnapshotSampler object which replays the order book of one pair and records spread, midpoint,
+        and liquidity as of each sample time, i.e. right after the last order with servert at or before it. Any sorted
+        grid of sample times works, such as period ends, every 100ms, or the times of trades. Orders can be fed in
+        chunks. The order book holds ticks and lots of the encoding, samples are recorded as decimals.
+
+        :param sample_times: sorted times at which the order book is sampled
+        :type sample_times: Iterable[float]
+        :param backend: name of the order book backend, see order_book.BOOK_BACKENDS
+        :type backend: str
+        :param encoding: tick and lot size of the pair, see price_encoding.get_encoding
+        :type encoding: price_encoding.PairEncoding
+        :param order_book: order book of the pair to start from, e.g. restored from a checkpoint, None for an empty book
+        :type order_book: order_book.BaseOrderBook
+        """
+        self.order_book = create_order_book(backend) if order_book is None else order_book
+        self.encoding = encoding
+        self.sample_times = np.asarray(sample_times, dtype=float)
+        num_samples = len(self.sample_times)
+        self.spread = np.full(num_samples, np.nan)
+        self.midpoint = np.full(num_samples, np.nan)
+        self.liquidity_bid = np.full(num_samples, np.nan)
+        self.liquidity_ask = np.full(num_samples, np.nan)
+        # index of the first sample that may still receive orders
+        self.next_sample = 0
+        # whether the order book changed since the last recorded sample
+        self.book_changed = True
+
+    def feed(self, prices, amounts, times):
+        """
+        Feed a chunk of orders of the pair sorted by servert. The orders closing each sample are found with one
+        searchsorted, and the order book is replayed straight from one checkpoint to the next.
+
+        :param prices: prices of the limit orders
+        :type prices: numpy.ndarray
+        :param amounts: amounts of the limit orders
+        :type amounts: numpy.ndarray
+        :param times: servert of the limit orders
+        :type times: numpy.ndarray
+        :return: None
+        :rtype: NoneType
+        """
+        times = np.asarray(times)
+        if len(times) == 0:
+            return
+        metrics.count("book_updates", len(times))
+        prices = self.encoding.encode_prices(prices)
+        amounts = self.encoding.encode_sizes(amounts)
+        # number of orders of the chunk at or before each pending sample time. A sample is closed once an order after
+        # it exists, the other samples may still receive orders from the next chunk
+        checkpoints = np.searchsorted(times, self.sample_times[self.next_sample :], side="right")
+        num_closed = int(np.searchsorted(checkpoints, len(times), side="left"))
+        start = 0
+        for sample_index, stop in enumerate(checkpoints[:num_closed].tolist(), self.next_sample):
+            if stop > start:
+                self.order_book.apply_updates(prices[start:stop], amounts[start:stop])
+                self.book_changed = True
+                start = stop
+            self._record(sample_index)
+        self.next_sample += num_closed
+        if start < len(times):
+            self.order_book.apply_updates(prices[start:], amounts[start:])
+            self.book_changed = True
+
+    def finish(self):
+        """
+        Record the samples that are still open, book data reached to the end.
+
+        :return: None
+        :rtype: NoneType
+        """
+        for sample_index in range(self.next_sample, len(self.sample_times)):
+            self._record(sample_index)
+        self.next_sample = len(self.sample_times)
+
+    def to_frame(self):
+        """
+        Collect the recorded samples into a dataframe.
+
+        :return: sample time, spread, midpoint, and liquidity of each sample
+        :rtype: pandas.DataFrame
+        """
+        return pd.DataFrame(
             {
-                "time_period": i + 1,
-                "period_end_time": end_time_lst[i + 1],
-                "high": curr_high,
-                "low": curr_low,
-                "last": curr_last,
-                "volume": curr_volume,
-            },
-            ignore_index=True,
+                "sample_time": self.sample_times,
+                "spread": self.spread,
+                "midpoint": self.midpoint,
+                "liquidity_bid": self.liquidity_bid,
+                "liquidity_ask": self.liquidity_ask,
+            }
         )
-    return agg_data
+
+    def fill(self, agg_data):
+        """
+        Fill spread, midpoint, and liquidity recorded for each period into agg_data, one sample per row.
+
+        :param agg_data: minute level aggregated market information data
+        :type agg_data: pandas.DataFrame
+        :return: a minute level aggregated market information data with spread, midpoint, and liquidity added
+        :rtype: pandas.DataFrame
+        """
+        agg_data["spread"] = self.spread
+        agg_data["midpoint"] = self.midpoint
+        agg_data["liquidity_bid"] = self.liquidity_bid
+        agg_data["liquidity_ask"] = self.liquidity_ask
+        return agg_data
+
+    def _record(self, sample_index):
+        """
+        Record the current spread, midpoint, and liquidity of the order book for a sample. A sample without orders
+        since the previous one copies its values.
+
+        :param sample_index: index of the sample
+        :type sample_index: int
+        :return: None
+        :rtype: NoneType
+        """
+        if not self.book_changed and sample_index > 0:
+            self.spread[sample_index] = self.spread[sample_index - 1]
+            self.midpoint[sample_index] = self.midpoint[sample_index - 1]
+            self.liquidity_bid[sample_index] = self.liquidity_bid[sample_index - 1]
+            self.liquidity_ask[sample_index] = self.liquidity_ask[sample_index - 1]
+            return
+        liquidity_bid, liquidity_ask = self.order_book.get_liquidity()
+        self.spread[sample_index] = self.encoding.decode_prices(self.order_book.get_spread())
+        self.midpoint[sample_index] = self.encoding.decode_prices(self.order_book.get_midpoint())
+        self.liquidity_bid[sample_index] = self.encoding.decode_sizes(liquidity_bid)
+        self.liquidity_ask[sample_index] = self.encoding.decode_sizes(liquidity_ask)
+        self.book_changed = False
 
 
-def retrieve_order_data(book_data, pair, agg_data):
+def period_sample_times(agg_data, last_sample_time=np.inf):
+    """
+    Get the times at which the order book is sampled for aggregated market data: the end time of each period, except
+    for the last period which by default keeps updating until book data depletes.
+
+    :param agg_data: minute level aggregated market information data
+    :type agg_data: pandas.DataFrame
+    :param last_sample_time: time the last period is sampled at, None for its end time
+    :type last_sample_time: float
+    :return: sample time of each period
+    :rtype: numpy.ndarray
+    """
+    sample_times = agg_data["period_end_time"].to_numpy(dtype=float, copy=True)
+    if len(sample_times) and last_sample_time is not None:
+        sample_times[-1] = last_sample_time
+    return sample_times
+
+
+def sample_order_book(
+    book_data, pair, sample_times, backend="rbtree", epoch_offset=EPOCH_OFFSET, order_book=None, start_time=None
+):
+    """
+    Get spread, midpoint, and liquidity of the order book of a pair as of each sample time.
+
+    :param book_data: order book data containing all limit order arrivals, an iterable of chunks of it, or the
+        directory of a binary cache built by data_io.build_cache
+    :type book_data: pandas.DataFrame or Iterable[pandas.DataFrame] or str
+    :param pair: pair name of two currencies
+    :type pair: str
+    :param sample_times: sorted times at which the order book is sampled
+    :type sample_times: Iterable[float]
+    :param backend: name of the order book backend, see order_book.BOOK_BACKENDS
+    :type backend: str
+    :param epoch_offset: time subtracted from the original servert when book_data is a cache directory
+    :type epoch_offset: int
+    :param order_book: order book of the pair at start_time, e.g. restored from a checkpoint, None for an empty book
+    :type order_book: order_book.BaseOrderBook
+    :param start_time: orders at or before this time are skipped as they are in order_book, None to feed all orders
+    :type start_time: int
+    :return: sampler holding the recorded samples
+    :rtype: SnapshotSampler
+    """
+    sampler = SnapshotSampler(sample_times, backend, get_encoding(pair), order_book)
+    if isinstance(book_data, str):
+        # only the partition of the pair is memory-mapped from the cache
+        pair_arrays = load_pair_arrays(book_data, pair, epoch_offset)
+        start = 0 if start_time is None else int(np.searchsorted(pair_arrays["servert"], start_time, side="right"))
+        sampler.feed(pair_arrays["price"][start:], pair_arrays["amount"][start:], pair_arrays["servert"][start:])
+    else:
+        for book_chunk in [book_data] if isinstance(book_data, pd.DataFrame) else book_data:
+            # filter order data based on pair
+            in_pair = book_chunk["pair"] == pair
+            if start_time is not None:
+                in_pair &= book_chunk["servert"] > start_time
+            book_data_sub = book_chunk.loc[in_pair]
+            sampler.feed(
+                book_data_sub["price"].to_numpy(), book_data_sub["amount"].to_numpy(), book_data_sub["servert"]
+            )
+    sampler.finish()
+    return sampler
+
+
+def retrieve_order_data(
+    book_data,
+    pair,
+    agg_data,
+    backend="rbtree",
+    epoch_offset=EPOCH_OFFSET,
+    last_sample_time=np.inf,
+    order_book=None,
+    start_time=None,
+):
     """
     Get spread, midpoint, and liquidity from book data. The information represents the status of the OrderBook at
     specific time. Time of retrieving is the last moment in each minute defined in aggregated market data (agg_data).
 
-    :param book_data: order book data containing all limit order arrivals
-    :type book_data: pandas.DataFrame
+    :param book_data: order book data containing all limit order arrivals, an iterable of chunks of it, or the
+        directory of a binary cache built by data_io.build_cache
+    :type book_data: pandas.DataFrame or Iterable[pandas.DataFrame] or str
     :param pair: pair name of two currencies
     :type pair: str
     :param agg_data: minute level aggregated market information data
     :type agg_data: pandas.DataFrame
+    :param backend: name of the order book backend, see order_book.BOOK_BACKENDS
+    :type backend: str
+    :param epoch_offset: time subtracted from the original servert when book_data is a cache directory
+    :type epoch_offset: int
+    :param last_sample_time: time the last period is sampled at, None for its end time, see period_sample_times
+    :type last_sample_time: float
+    :param order_book: order book of the pair at start_time, e.g. restored from a checkpoint, None for an empty book
+    :type order_book: order_book.BaseOrderBook
+    :param start_time: orders at or before this time are skipped as they are in order_book, None to feed all orders
+    :type start_time: int
     :return: a minute level aggregated market information data with spread, midpoint, and liquidity added
     :rtype: pandas.DataFrame
     """
-    # filter order data based on pair
-    book_data_sub = book_data.loc[book_data["pair"] == pair]
-    book_data_sub.reset_index(drop=True, inplace=True)
-    # print(book_data_sub.head())
-    order_book = OrderBook()
-    agg_index = 0
-    for i in range(len(book_data_sub)):
-        # update order book
-        order_book.update_order(book_data_sub["price"][i], book_data_sub["amount"][i])
-        # get the time of next order
-        if i + 1 < len(book_data_sub):
-            next_time = book_data_sub["servert"][i + 1]
-        # book data reached to the end, set next time as last time
-        else:
-            next_time = book_data_sub["servert"][i]
-        curr_end_time = agg_data["period_end_time"][agg_index]
-        # record data to agg_data when (1) next time surpasses the end time of current period and agg_data has at least
-        # two rows unfilled. (2) agg_data reaches to the last row.
-        # In case (2) the last row of agg_data will keep updating until book data depletes
-        if ((next_time > curr_end_time) and (agg_index < len(agg_data))) or (agg_index == len(agg_data) - 1):
-            # get info from order book
-            curr_spread = order_book.get_spread()
-            curr_midpoint = order_book.get_midpoint()
-            curr_bid_liquidity, curr_ask_liquidity = order_book.get_liquidity()
-            # fill in values into agg data
-            agg_data["spread"][agg_index] = curr_spread
-            agg_data["midpoint"][agg_index] = curr_midpoint
-            agg_data["liquidity_bid"][agg_index] = curr_bid_liquidity
-            agg_data["liquidity_ask"][agg_index] = curr_ask_liquidity
-            # when agg_data reaches to the last row, index stop moving forward
-            if agg_index < len(agg_data) - 1:
-                agg_index += 1
+    sample_times = period_sample_times(agg_data, last_sample_time)
+    sampler = sample_order_book(book_data, pair, sample_times, backend, epoch_offset, order_book, start_time)
+    return sampler.fill(agg_data)
 
-    return agg_data
+
+def rolling_std(values, window):
+    """
+    Compute the population standard deviation of every window of consecutive values with the two-pass formula of
+    np.std, each window around its own mean, so that a quiet window keeps its precision next to volatile ones. The
+    windows are strided views into values, reduced in blocks of rows to bound the temporary arrays. A window containing
+    NaN has NaN standard deviation.
+
+    :param values: series of values
+    :type values: numpy.ndarray
+    :param window: number of values in a window
+    :type window: int
+    :return: standard deviation of values[i : i + window] for each i
+    :rtype: numpy.ndarray
+    """
+    values = np.ascontiguousarray(values, dtype=float)
+    num_windows = len(values) - window + 1
+    if num_windows <= 0:
+        return np.empty(0)
+    stride = values.strides[0]
+    windows = np.lib.stride_tricks.as_strided(
+        values, shape=(num_windows, window), strides=(stride, stride), writeable=False
+    )
+    std = np.empty(num_windows)
+    block_rows = max(ROLLING_BLOCK_SIZE // window, 1)
+    for start in range(0, num_windows, block_rows):
+        std[start : start + block_rows] = np.std(windows[start : start + block_rows], axis=1)
+    return std
+
+
+def compute_vols(agg_data, vol_columns):
+    """
+    Compute many volatility columns in one call. Returns are computed once per price type and return interval and
+    shared by all windows on them.
+
+    :param agg_data: minute level aggregated market information data
+    :type agg_data: pandas.DataFrame
+    :param vol_columns: (price type, return interval, number of periods) keyed by the name of the volatility column
+    :type vol_columns: dict
+    :return: a dataframe with one column of volatility per entry of vol_columns
+    :rtype: pandas.DataFrame
+    """
+    returns = {}
+    vols = {}
+    for column, (price_type, return_interval, num_periods) in vol_columns.items():
+        if (price_type, return_interval) not in returns:
+            price = agg_data[price_type].to_numpy(dtype=float)
+            start_price = price[0 : len(price) - return_interval]
+            end_price = price[return_interval:]
+            returns[price_type, return_interval] = (end_price - start_price) / start_price
+        r = returns[price_type, return_interval]
+        # the volatility of a window is reported in the period after its last return, the last window is not used
+        vol = rolling_std(r, num_periods)[: max(len(r) - num_periods, 0)]
+        # add "NA" and extend length of vol in order to match the length of columns in agg_data
+        vols[column] = np.concatenate([np.full(len(agg_data) - len(vol), np.nan), vol])
+    return pd.DataFrame(vols, index=agg_data.index)
 
 
 def compute_vol(agg_data, price_type, return_interval, num_periods):
@@ -121,71 +549,255 @@ def compute_vol(agg_data, price_type, return_interval, num_periods):
     :return: a dataframe with single column of volatility
     :rtype: pandas.DataFrame
     """
-    start_price = agg_data[price_type][0 : len(agg_data) - return_interval].to_numpy()
-    end_price = agg_data[price_type][return_interval : len(agg_data)].to_numpy()
-    r = (end_price - start_price) / start_price
-    vol_lst = []
-    for i in range(len(r) - num_periods):
-        vol = np.std(r[i : i + num_periods])
-        vol_lst.append(vol)
-    # add "NA" and extend length of vol_lst in order to match the length of columns in agg_data
-    vol_lst = [np.nan for i in range(len(agg_data) - len(vol_lst))] + vol_lst
-    return pd.DataFrame(vol_lst)
+    vols = compute_vols(agg_data, {0: (price_type, return_interval, num_periods)})
+    return vols.reset_index(drop=True)
 
 
-def fill_vol(agg_data):
+def fill_vol(agg_data, vol_columns=VOL_COLUMNS):
     """
     Computed volatility and fill them into the aggregated minute level market data (agg_data).
 
     :param agg_data: minute level aggregated market information data
     :type agg_data: pandas.DataFrame
+    :param vol_columns: (price type, return interval, number of periods) keyed by the name of the volatility column
+    :type vol_columns: dict
     :return: a dataframe of minute level aggregated market information with volatility filled
     :rtype: pandas.DataFrame
     """
-    v_mid_1 = compute_vol(agg_data, "midpoint", 1, 10)
-    v_mid_3 = compute_vol(agg_data, "midpoint", 3, 10)
-    v_last_1 = compute_vol(agg_data, "last", 1, 10)
-    v_last_3 = compute_vol(agg_data, "last", 3, 10)
-
-    agg_data["volatility_mid_1min"] = v_mid_1
-    agg_data["volatility_mid_3min"] = v_mid_3
-    agg_data["volatility_last_1min"] = v_last_1
-    agg_data["volatility_last_3min"] = v_last_3
+    vols = compute_vols(agg_data, vol_columns)
+    for column in vol_columns:
+        agg_data[column] = vols[column]
     return agg_data
 
 
-if __name__ == "__main__":
-    book_data = pd.read_csv("/Users/ramborghini/Desktop/midpoint/book.csv")
-    trade_data = pd.read_csv("/Users/ramborghini/Desktop/midpoint/trades.csv")
-    # convert servert to microseconds from 0:00:00 8/16/19 UTC (which is 1565913600 in seconds)
-    # servert in the data is in microseconds (= seconds * 1000000)
-    book_data["servert"] = book_data["servert"] - (1565913600 * 1000000)
-    trade_data["servert"] = trade_data["servert"] - (1565913600 * 1000000)
-
-    # create an empty dataframe to hold aggregated market information
-    agg_empty = pd.DataFrame(
-        columns=[
-            "time_period",
-            "period_end_time",
-            "high",
-            "low",
-            "last",
-            "volume",
-            "spread",
-            "midpoint",
-            "liquidity_bid",
-            "liquidity_ask",
-            "volatility_mid_1min",
-            "volatility_mid_3min",
-            "volatility_last_1min",
-            "volatility_last_3min",
-        ]
+def compute_pair_market_data(
+    book_cache,
+    trade_cache,
+    pair,
+    epoch_offset=EPOCH_OFFSET,
+    start_time=None,
+    backend="rbtree",
+    agg_columns=AGG_COLUMNS,
+    vol_columns=VOL_COLUMNS,
+    last_sample_time=np.inf,
+    checkpoint=None,
+):
+    """
+    Compute the aggregated market information of one pair in one session from binary caches: trade bars, order book
+    samples, and volatility. Only the partitions of the pair are memory-mapped, so that this runs in a worker process
+    without any data passed to it but paths.
+
+    :param book_cache: directory of the binary cache of book data
+    :type book_cache: str
+    :param trade_cache: directory of the binary cache of trade data
+    :type trade_cache: str
+    :param pair: pair name of two currencies
+    :type pair: str
+    :param epoch_offset: start of the session in microseconds since epoch
+    :type epoch_offset: int
+    :param start_time: trades at or before this time from the session start are dropped and only carry the prices of
+        their last bar into empty bars at the session start, None to keep them in the first bar
+    :type start_time: int
+    :param backend: name of the order book backend, see order_book.BOOK_BACKENDS
+    :type backend: str
+    :param agg_columns: columns of the aggregated market information
+    :type agg_columns: list
+    :param vol_columns: volatility columns filled in, see fill_vol, empty to leave them NaN
+    :type vol_columns: dict
+    :param last_sample_time: time the order book is sampled at for the last period, None for its end time
+    :type last_sample_time: float
+    :param checkpoint: path of a book_checkpoint snapshot at the session start to replay the order book from, None to
+        replay it from the start of the cache
+    :type checkpoint: str
+    :return: a dataframe of minute level aggregated market information
+    :rtype: pandas.DataFrame
+    """
+    trade_arrays = load_pair_arrays(trade_cache, pair, epoch_offset)
+    start = 0 if start_time is None else int(np.searchsorted(trade_arrays["servert"], start_time, side="right"))
+    trade_data = pd.DataFrame(
+        {
+            "pair": pair,
+            "price": trade_arrays["price"][start:],
+            "amount": trade_arrays["amount"][start:],
+            "servert": trade_arrays["servert"][start:],
+        }
     )
+    seed_data = None
+    if start > 0:
+        # the last bar before the session holds trades of at most one bar width before the last of them
+        servert = trade_arrays["servert"]
+        seed_start = int(np.searchsorted(servert, servert[start - 1] - BAR_WIDTH, side="right"))
+        seed_data = pd.DataFrame(
+            {"pair": pair, "price": trade_arrays["price"][seed_start:start], "servert": servert[seed_start:start]}
+        )
+    with metrics.timer("trade_bars"):
+        agg_data = aggregate_trade_data(pd.DataFrame(columns=agg_columns), trade_data, pair, seed_data=seed_data)
+    with metrics.timer("book_sampling"):
+        if checkpoint is None:
+            order_book, book_start = None, None
+        else:
+            # the snapshot holds every order at or before the session start
+            order_book, book_start = load_checkpoint(checkpoint, backend, [pair])[pair], 0
+        agg_data = retrieve_order_data(
+            book_cache, pair, agg_data, backend, epoch_offset, last_sample_time, order_book, book_start
+        )
+    with metrics.timer("volatility"):
+        return fill_vol(agg_data, vol_columns)
+
+
+def save_pair_checkpoints(book_cache, checkpoint_dir, pair, checkpoint_times, backend="rbtree"):
+    """
+    Replay the order book of one pair and save a book_checkpoint snapshot of it at each of the given times, so that
+    the pairs are checkpointed in parallel.
+
+    :param book_cache: directory of the binary cache of book data
+    :type book_cache: str
+    :param checkpoint_dir: directory the snapshots of the pair are written to
+    :type checkpoint_dir: str
+    :param pair: pair name of two currencies
+    :type pair: str
+    :param checkpoint_times: times of the snapshots in ascending order, in microseconds since epoch
+    :type checkpoint_times: list
+    :param backend: name of the order book backend used for the replay
+    :type backend: str
+    :return: paths of the snapshots in time order
+    :rtype: list
+    """
+    with metrics.timer("checkpoints"):
+        save_checkpoints(book_cache, checkpoint_dir, checkpoint_times, [pair], 0, backend)
+    return [checkpoint_path(checkpoint_dir, index) for index in range(len(checkpoint_times))]
+
+
+def compute_market_data_parallel(
+    book_cache, trade_cache, pairs=PAIRS, days=None, max_workers=None, backend="rbtree", vol_columns=VOL_COLUMNS
+):
+    """
+    Compute the aggregated market information of all pairs with one shard per pair, and per day if days are given,
+    run in a pool of worker processes. Workers memory-map their partition of the binary caches, so the input is
+    shared through the page cache instead of being pickled to every worker. Shards are merged in the order of pairs
+    and days, so the output does not depend on the number of workers or on which shard finished first.
+
+    The order book of each pair is replayed once by a checkpoint task of its own, which saves book_checkpoint
+    snapshots at the start of every day but the first. The later day shards of a pair are submitted as soon as its
+    snapshots are saved and replay their book from the snapshot of their day, so the work grows linearly with the
+    number of days. The last period of each day is sampled at the end of the day, except on the last day which keeps
+    updating until book data depletes. Empty bars at the start of a day carry the prices of the day before, and
+    volatility is computed once over the merged days, so the output matches one session spanning all days.
+
+    :param book_cache: directory of the binary cache of book data
+    :type book_cache: str
+    :param trade_cache: directory of the binary cache of trade data
+    :type trade_cache: str
+    :param pairs: pair names of two currencies
+    :type pairs: list
+    :param days: start of the session of each day in microseconds since epoch in ascending order, None for one
+        session from EPOCH_OFFSET
+    :type days: list
+    :param max_workers: number of worker processes, None for the number of cpus, 1 to run in this process
+    :type max_workers: int
+    :param backend: name of the order book backend, see order_book.BOOK_BACKENDS
+    :type backend: str
+    :param vol_columns: volatility columns filled in over all days, see fill_vol, empty to leave them NaN
+    :type vol_columns: dict
+    :return: dataframes of minute level aggregated market information keyed by pair, days one after another
+    :rtype: dict
+    """
+    day_offsets = [EPOCH_OFFSET] if days is None else list(days)
+
+    def get_shard(pair, day_index, checkpoint):
+        # trades before the first day go to its first bar, trades of a later day start after the end of the day before
+        return (
+            book_cache,
+            trade_cache,
+            pair,
+            day_offsets[day_index],
+            None if day_index == 0 else 0,
+            backend,
+            AGG_COLUMNS,
+            {},
+            np.inf if day_index == len(day_offsets) - 1 else None,
+            checkpoint,
+        )
+
+    with tempfile.TemporaryDirectory() as checkpoint_dir:
+        # snapshots of the order book of each pair at the start of each later day, in microseconds since epoch
+        checkpoint_tasks = {
+            pair: (book_cache, os.path.join(checkpoint_dir, str(pair_index)), pair, day_offsets[1:], backend)
+            for pair_index, pair in enumerate(pairs)
+        }
+        if max_workers == 1:
+            results = {}
+            for pair in pairs:
+                checkpoints = save_pair_checkpoints(*checkpoint_tasks[pair]) if len(day_offsets) > 1 else []
+                for day_index, checkpoint in enumerate([None] + checkpoints):
+                    results[pair, day_index] = compute_pair_market_data(*get_shard(pair, day_index, checkpoint))
+        else:
+            # metrics of the workers are merged into the metrics of this process
+            collect = metrics.active() is not None
+            with ProcessPoolExecutor(max_workers) as executor:
+                futures = {}
+
+                def submit_shard(pair, day_index, checkpoint):
+                    shard = get_shard(pair, day_index, checkpoint)
+                    futures[pair, day_index] = executor.submit(
+                        metrics.call_collected, compute_pair_market_data, shard, collect
+                    )
+
+                # the first day replays its book from the start of the cache and does not wait for any snapshot
+                for pair in pairs:
+                    submit_shard(pair, 0, None)
+                checkpoint_futures = {}
+                if len(day_offsets) > 1:
+                    checkpoint_futures = {
+                        executor.submit(metrics.call_collected, save_pair_checkpoints, task, collect): pair
+                        for pair, task in checkpoint_tasks.items()
+                    }
+                for checkpoint_future in as_completed(checkpoint_futures):
+                    pair = checkpoint_futures[checkpoint_future]
+                    checkpoints, checkpoint_metrics = checkpoint_future.result()
+                    metrics.merge(checkpoint_metrics)
+                    for day_index, checkpoint in enumerate(checkpoints, 1):
+                        submit_shard(pair, day_index, checkpoint)
+                results = {}
+                for pair in pairs:
+                    for day_index in range(len(day_offsets)):
+                        agg_data, shard_metrics = futures[pair, day_index].result()
+                        metrics.merge(shard_metrics)
+                        results[pair, day_index] = agg_data
+
+    market_data = {}
+    for pair in pairs:
+        day_results = [results[pair, day_index] for day_index in range(len(day_offsets))]
+        num_periods = 0
+        for day_offset, agg_data in zip(day_offsets, day_results):
+            # number periods and times of later days on from the start of the first day
+            agg_data["time_period"] += num_periods
+            agg_data["period_end_time"] += day_offset - day_offsets[0]
+            num_periods += len(agg_data)
+        with metrics.timer("volatility"):
+            market_data[pair] = fill_vol(pd.concat(day_results, ignore_index=True), vol_columns)
+    return market_data
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    run_metrics = metrics.enable()
+
+    book_path = "/Users/ramborghini/Desktop/midpoint/book.csv"
+    trade_path = "/Users/ramborghini/Desktop/midpoint/trades.csv"
+
+    # binary caches memory-mapped by the worker processes, built from the csv files on the first run
+    book_cache = "./cache/book"
+    trade_cache = "./cache/trades"
+    for csv_path, cache_dir in [(book_path, book_cache), (trade_path, trade_cache)]:
+        if not os.path.exists(os.path.join(cache_dir, "meta.json")):
+            with metrics.timer("build_cache"):
+                build_cache(csv_path, cache_dir)
 
-    # for each pair of currencies, compute features of the market based on trade data and book data
-    for pair in ["BTC-USD", "BTC-EUR", "BCH-USD", "BCH-EUR", "BCH-BTC"]:
-        agg_temp = aggregate_trade_data(agg_empty, trade_data, pair)
-        agg_data = retrieve_order_data(book_data, pair, agg_temp)
-        agg_result = fill_vol(agg_data)
+    # for each pair of currencies, compute features of the market based on trade data and book data in parallel
+    market_data = compute_market_data_parallel(book_cache, trade_cache, PAIRS)
+    for pair, agg_result in market_data.items():
         # store data as csv for later use
-        agg_result.to_csv("./data_output/ "+ pair + ".csv", index=False)
+        with metrics.timer("csv_write"):
+            agg_result.to_csv("./data_output/" + pair + ".csv", index=False)
+    run_metrics.export("./data_output/metrics_compute_market_data.json")
@@ -0,0 +1,141 @@
+import numpy as np
+import math
+
+
+def split_pair(pair):
+    """
+    Split a pair name into its base and quote currency.
+
+    :param pair: pair name of two currencies such as "BCH-BTC", base currency first
+    :type pair: str
+    :return: base currency and quote currency
+    :rtype: str, str
+    """
+    base, quote = pair.split("-")
+    return base, quote
+
+
+def rank_currencies(pairs):
+    """
+    Order currencies so that quote currencies come first in the order of their pairs, followed by the remaining base
+    currencies. Every cycle starts from its currency of lowest rank, so cycles start from the first listed quote
+    currency they trade (USD before EUR before BTC for the default pairs).
+
+    :param pairs: pair names of two currencies
+    :type pairs: list
+    :return: rank of each currency keyed by currency
+    :rtype: dict
+    """
+    ranks = {}
+    for pair in pairs:
+        ranks.setdefault(split_pair(pair)[1], len(ranks))
+    for pair in pairs:
+        ranks.setdefault(split_pair(pair)[0], len(ranks))
+    return ranks
+
+
+def find_cycles(pairs, max_length=4):
+    """
+    Enumerate every arbitrage cycle of 3 to max_length legs over the currency graph of the pairs. Trading a pair
+    from quote to base currency buys at the best ask (direction 1), trading it from base to quote currency sells at
+    the best bid (direction -1). Cycles are sorted by length and by the ranks of the currencies they pass.
+
+    :param pairs: pair names of two currencies
+    :type pairs: list
+    :param max_length: maximum number of legs in a cycle
+    :type max_length: int
+    :return: legs of each cycle in trading order as (pair, direction)
+    :rtype: list
+    """
+    ranks = rank_currencies(pairs)
+    edges = {currency: [] for currency in ranks}
+    for pair in pairs:
+        base, quote = split_pair(pair)
+        edges[quote].append((base, pair, 1))
+        edges[base].append((quote, pair, -1))
+
+    found = []
+
+    def extend(start, path, legs):
+        for currency, pair, direction in edges[path[-1]]:
+            if currency == start and len(legs) >= 2:
+                found.append(([ranks[c] for c in path], legs + [(pair, direction)]))
+            # only visit currencies ranked after the start so that each cycle is found from one starting point
+            elif len(legs) + 1 < max_length and ranks[currency] > ranks[start] and currency not in path:
+                extend(start, path + [currency], legs + [(pair, direction)])
+
+    for start in ranks:
+        extend(start, [start], [])
+    found.sort(key=lambda cycle: (len(cycle[1]), cycle[0]))
+    return [legs for _, legs in found]
+
+
+class CurrencyGraph:
+    def __init__(self, pairs, max_length=4):
+        """
+        Instantiate CurrencyGraph object which precompiles the arbitrage cycles of the pairs into leg index and sign
+        matrices, so that the log return of every cycle is a dot product of its signs with the gathered log best prices
+
+        :param pairs: pair names of two currencies
+        :type pairs: list
+        :param max_length: maximum number of legs in a cycle
+        :type max_length: int
+        """
+        self.pairs = list(pairs)
+        self.pair_index = {pair: i for i, pair in enumerate(self.pairs)}
+        self.cycles = find_cycles(self.pairs, max_length)
+        num_pairs = len(self.pairs)
+        # direction of each pair in each cycle, 0 if the cycle does not trade the pair
+        self.directions = np.zeros((len(self.cycles), num_pairs), dtype=np.int8)
+        # log prices are stored as [log best bids, log best asks, 0]. Selling adds log(bid), buying subtracts log(ask).
+        # Cycles shorter than max_length are padded with the constant 0 slot, so NaN prices of pairs outside a cycle
+        # never reach its return
+        self.log_prices = np.full(2 * num_pairs + 1, np.nan)
+        self.log_prices[-1] = 0.0
+        self.leg_columns = np.full((len(self.cycles), max_length), 2 * num_pairs)
+        self.leg_signs = np.zeros((len(self.cycles), max_length))
+        for cycle_index, legs in enumerate(self.cycles):
+            for leg_index, (pair, direction) in enumerate(legs):
+                self.directions[cycle_index, self.pair_index[pair]] = direction
+                if direction > 0:
+                    self.leg_columns[cycle_index, leg_index] = self.pair_index[pair] + num_pairs
+                    self.leg_signs[cycle_index, leg_index] = -1.0
+                else:
+                    self.leg_columns[cycle_index, leg_index] = self.pair_index[pair]
+                    self.leg_signs[cycle_index, leg_index] = 1.0
+        self.log_returns = np.full(len(self.cycles), np.nan)
+        # cycles trading each pair with their legs, so that an update only re-evaluates these
+        self.cycles_by_pair = [np.flatnonzero(self.directions[:, i]) for i in range(num_pairs)]
+        self.leg_columns_by_pair = [self.leg_columns[cycle_indices] for cycle_indices in self.cycles_by_pair]
+        self.leg_signs_by_pair = [self.leg_signs[cycle_indices] for cycle_indices in self.cycles_by_pair]
+
+    def update_pair(self, pair_index, bid_max, ask_min):
+        """
+        Set the best bid and ask of a pair and re-evaluate the cycles that trade it.
+
+        :param pair_index: index of the pair in pairs
+        :type pair_index: int
+        :param bid_max: best bid price of the pair, NaN if the bid side is empty
+        :type bid_max: float
+        :param ask_min: best ask price of the pair, NaN if the ask side is empty
+        :type ask_min: float
+        :return: indices of the re-evaluated cycles and their returns
+        :rtype: numpy.ndarray, numpy.ndarray
+        """
+        log_prices = self.log_prices
+        log_prices[pair_index] = math.log(bid_max)
+        log_prices[pair_index + len(self.pairs)] = math.log(ask_min)
+        cycle_indices = self.cycles_by_pair[pair_index]
+        leg_log_prices = log_prices[self.leg_columns_by_pair[pair_index]]
+        log_returns = (self.leg_signs_by_pair[pair_index] * leg_log_prices).sum(axis=1)
+        self.log_returns[cycle_indices] = log_returns
+        return cycle_indices, np.expm1(log_returns)
+
+    def get_returns(self):
+        """
+        Calculate the returns of all cycles from the current best prices.
+
+        :return: return of each cycle
+        :rtype: numpy.ndarray
+        """
+        return np.expm1((self.leg_signs * self.log_prices[self.leg_columns]).sum(axis=1))
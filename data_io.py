@@ -0,0 +1,321 @@
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+import metrics
+
+PAIRS = ["BTC-USD", "BTC-EUR", "BCH-USD", "BCH-EUR", "BCH-BTC"]
+
+# 0:00:00 8/16/19 UTC (which is 1565913600 in seconds) in microseconds, servert in the data is in microseconds
+EPOCH_OFFSET = 1565913600 * 1000000
+
+# number of rows parsed at a time when streaming a csv file
+CHUNK_SIZE = 1000000
+
+# columns shared by book.csv and trades.csv with their types
+COLUMN_DTYPES = {"price": np.float64, "amount": np.float64, "servert": np.int64}
+
+
+def read_csv_chunks(path, pairs=PAIRS, chunksize=CHUNK_SIZE, epoch_offset=EPOCH_OFFSET):
+    """
+    Stream book or trade data from a csv file in typed chunks, so that only one chunk is held in memory. The pair
+    column is categorical over pairs, with its integer codes in an added pair_code column (-1 for pairs not listed),
+    and servert is converted to microseconds from epoch_offset.
+
+    :param path: path of book.csv or trades.csv
+    :type path: str
+    :param pairs: pair names of two currencies to keep as categories
+    :type pairs: list
+    :param chunksize: number of rows per chunk
+    :type chunksize: int
+    :param epoch_offset: time subtracted from servert, in microseconds
+    :type epoch_offset: int
+    :return: chunks of data with columns pair, price, amount, servert, pair_code
+    :rtype: Iterator[pandas.DataFrame]
+    """
+    dtype = dict(COLUMN_DTYPES, pair=pd.CategoricalDtype(pairs))
+    chunks = iter(pd.read_csv(path, usecols=list(dtype), dtype=dtype, chunksize=chunksize))
+    while True:
+        # only parsing is timed, not the consumer of the chunk
+        with metrics.timer("csv_read"):
+            chunk = next(chunks, None)
+            if chunk is not None:
+                chunk["servert"] -= epoch_offset
+                chunk["pair_code"] = chunk["pair"].cat.codes
+        if chunk is None:
+            return
+        metrics.count("csv_rows", len(chunk))
+        yield chunk
+
+
+# columns stored for each pair in a binary cache, seq is the position of the row in the time-sorted stream of all pairs
+CACHE_DTYPES = {"price": np.float64, "amount": np.float64, "servert": np.int64, "seq": np.int64}
+
+
+def build_cache(csv_path, cache_dir, pairs=PAIRS, chunksize=CHUNK_SIZE, epoch_offset=EPOCH_OFFSET):
+    """
+    Convert book.csv or trades.csv once into a binary cache of normalized, pair-partitioned, time-sorted columns. Each
+    pair gets a directory with one .npy file per column, which load_pair_arrays memory-maps without parsing. The csv
+    file is streamed, so memory stays bounded unless the file is not sorted by servert.
+
+    :param csv_path: path of book.csv or trades.csv
+    :type csv_path: str
+    :param cache_dir: directory the cache is written to
+    :type cache_dir: str
+    :param pairs: pair names of two currencies to keep
+    :type pairs: list
+    :param chunksize: number of rows parsed at a time
+    :type chunksize: int
+    :param epoch_offset: time subtracted from servert, in microseconds
+    :type epoch_offset: int
+    :return: None
+    :rtype: NoneType
+    """
+    for pair in pairs:
+        os.makedirs(os.path.join(cache_dir, pair), exist_ok=True)
+    raw_files = {
+        (pair, column): open(_cache_path(cache_dir, pair, column) + ".bin", "wb")
+        for pair in pairs
+        for column in CACHE_DTYPES
+    }
+    num_rows = dict.fromkeys(pairs, 0)
+    time_sorted = True
+    last_time = None
+    stream_row = 0
+    try:
+        for chunk in read_csv_chunks(csv_path, pairs, chunksize, epoch_offset):
+            # rows of pairs that are not listed are dropped
+            chunk = chunk.loc[chunk["pair_code"] >= 0]
+            servert = chunk["servert"].to_numpy()
+            if len(servert):
+                time_sorted = time_sorted and (last_time is None or last_time <= servert[0])
+                time_sorted = time_sorted and bool(np.all(servert[1:] >= servert[:-1]))
+                last_time = servert[-1]
+            columns = {
+                "price": chunk["price"].to_numpy(),
+                "amount": chunk["amount"].to_numpy(),
+                "servert": servert,
+                "seq": np.arange(stream_row, stream_row + len(chunk), dtype=np.int64),
+            }
+            stream_row += len(chunk)
+            pair_codes = chunk["pair_code"].to_numpy()
+            for pair_code, pair in enumerate(pairs):
+                in_pair = pair_codes == pair_code
+                num_rows[pair] += int(in_pair.sum())
+                for column, values in columns.items():
+                    values[in_pair].astype(CACHE_DTYPES[column]).tofile(raw_files[pair, column])
+    finally:
+        for raw_file in raw_files.values():
+            raw_file.close()
+
+    raw = {
+        (pair, column): np.memmap(raw_files[pair, column].name, dtype=dtype, mode="r", shape=(num_rows[pair],))
+        if num_rows[pair]
+        else np.empty(0, dtype=dtype)
+        for pair in pairs
+        for column, dtype in CACHE_DTYPES.items()
+    }
+    orders = {}
+    if not time_sorted:
+        # position of every row in the stream sorted by servert, ties keep the file order
+        all_servert = np.concatenate([raw[pair, "servert"] for pair in pairs])
+        all_stream_row = np.concatenate([raw[pair, "seq"] for pair in pairs])
+        stream_order = np.lexsort((all_stream_row, all_servert))
+        positions = np.empty(len(stream_order), dtype=np.int64)
+        positions[stream_order] = np.arange(len(stream_order))
+        start = 0
+        for pair in pairs:
+            raw[pair, "seq"] = positions[start : start + num_rows[pair]]
+            orders[pair] = np.argsort(raw[pair, "seq"], kind="stable")
+            start += num_rows[pair]
+
+    for pair in pairs:
+        for column, dtype in CACHE_DTYPES.items():
+            values = raw[pair, column]
+            out = np.lib.format.open_memmap(
+                _cache_path(cache_dir, pair, column) + ".npy", mode="w+", dtype=dtype, shape=(num_rows[pair],)
+            )
+            out[:] = values[orders[pair]] if pair in orders else values
+            out.flush()
+            del out
+    del raw
+    for raw_file in raw_files.values():
+        os.remove(raw_file.name)
+    with open(os.path.join(cache_dir, "meta.json"), "w") as meta_file:
+        json.dump({"pairs": list(pairs), "epoch_offset": epoch_offset, "num_rows": num_rows}, meta_file)
+
+
+def load_cache_meta(cache_dir):
+    """
+    Load the description of a binary cache.
+
+    :param cache_dir: directory of the cache
+    :type cache_dir: str
+    :return: pairs, epoch offset of servert, and number of rows per pair
+    :rtype: dict
+    """
+    with open(os.path.join(cache_dir, "meta.json")) as meta_file:
+        return json.load(meta_file)
+
+
+def load_pair_arrays(cache_dir, pair, epoch_offset=None):
+    """
+    Memory-map the time-sorted columns of one pair from a binary cache. No data is copied unless servert has to be
+    shifted to another epoch offset.
+
+    :param cache_dir: directory of the cache
+    :type cache_dir: str
+    :param pair: pair name of two currencies
+    :type pair: str
+    :param epoch_offset: time subtracted from the original servert, None to keep the offset of the cache
+    :type epoch_offset: int
+    :return: read-only arrays keyed by column name
+    :rtype: dict
+    """
+    arrays = {
+        column: np.load(_cache_path(cache_dir, pair, column) + ".npy", mmap_mode="r") for column in CACHE_DTYPES
+    }
+    cache_offset = load_cache_meta(cache_dir)["epoch_offset"]
+    if epoch_offset is not None and epoch_offset != cache_offset:
+        arrays["servert"] = arrays["servert"] + (cache_offset - epoch_offset)
+    return arrays
+
+
+def read_cache_chunks(
+    cache_dir, pairs=PAIRS, chunksize=CHUNK_SIZE, epoch_offset=EPOCH_OFFSET, start_time=None, stop_time=None
+):
+    """
+    Stream all pairs of a binary cache merged in time order, in chunks of the same layout as read_csv_chunks. A time
+    range selects a contiguous part of the stream, so that shards of the timeline can be read independently.
+
+    :param cache_dir: directory of the cache
+    :type cache_dir: str
+    :param pairs: pair names of two currencies to keep as categories
+    :type pairs: list
+    :param chunksize: number of rows per chunk
+    :type chunksize: int
+    :param epoch_offset: time subtracted from the original servert, in microseconds
+    :type epoch_offset: int
+    :param start_time: only rows after this servert are read, None to read from the start
+    :type start_time: int
+    :param stop_time: only rows at or before this servert are read, None to read to the end
+    :type stop_time: int
+    :return: chunks of data with columns pair, price, amount, servert, pair_code
+    :rtype: Iterator[pandas.DataFrame]
+    """
+    meta = load_cache_meta(cache_dir)
+    pair_arrays = [load_pair_arrays(cache_dir, pair, epoch_offset) for pair in meta["pairs"]]
+    # the stream is sorted by servert, so the rows of a time range are a contiguous range of seq
+    starts = [
+        0 if start_time is None else int(np.searchsorted(arrays["servert"], start_time, side="right"))
+        for arrays in pair_arrays
+    ]
+    stream_start = sum(starts)
+    stream_stop = (
+        sum(meta["num_rows"].values())
+        if stop_time is None
+        else sum(int(np.searchsorted(arrays["servert"], stop_time, side="right")) for arrays in pair_arrays)
+    )
+    for chunk_start in range(stream_start, stream_stop, chunksize):
+        chunk_end = min(chunk_start + chunksize, stream_stop)
+        chunk = _read_cache_chunk(meta, pair_arrays, starts, chunk_start, chunk_end, pairs)
+        if chunk is not None:
+            metrics.count("cache_rows", len(chunk))
+            yield chunk
+
+
+def read_chunks(source, pairs=PAIRS, chunksize=CHUNK_SIZE, epoch_offset=EPOCH_OFFSET):
+    """
+    Stream book or trade data from either a csv file or a binary cache directory built by build_cache.
+
+    :param source: path of a csv file or of a cache directory
+    :type source: str
+    :param pairs: pair names of two currencies to keep as categories
+    :type pairs: list
+    :param chunksize: number of rows per chunk
+    :type chunksize: int
+    :param epoch_offset: time subtracted from the original servert, in microseconds
+    :type epoch_offset: int
+    :return: chunks of data with columns pair, price, amount, servert, pair_code
+    :rtype: Iterator[pandas.DataFrame]
+    """
+    if os.path.isdir(source):
+        return read_cache_chunks(source, pairs, chunksize, epoch_offset)
+    return read_csv_chunks(source, pairs, chunksize, epoch_offset)
+
+
+def _read_cache_chunk(meta, pair_arrays, starts, chunk_start, chunk_end, pairs):
+    """
+    Merge the rows of all pairs at positions chunk_start to chunk_end of the stream into one chunk, and advance the
+    start of each pair past them.
+
+    :param meta: description of the cache
+    :type meta: dict
+    :param pair_arrays: memory-mapped columns of each pair of the cache
+    :type pair_arrays: list
+    :param starts: index of the next row of each pair, updated in place
+    :type starts: list
+    :param chunk_start: position of the first row of the chunk in the stream
+    :type chunk_start: int
+    :param chunk_end: position after the last row of the chunk in the stream
+    :type chunk_end: int
+    :param pairs: pair names of two currencies to keep as categories
+    :type pairs: list
+    :return: chunk of data with columns pair, price, amount, servert, pair_code, None if no row falls into it
+    :rtype: pandas.DataFrame
+    """
+    with metrics.timer("cache_read"):
+        # rows of each pair whose position in the merged stream falls into this chunk
+        pieces = []
+        for cache_code, arrays in enumerate(pair_arrays):
+            stop = int(np.searchsorted(arrays["seq"], chunk_end))
+            if stop > starts[cache_code]:
+                piece = {column: values[starts[cache_code] : stop] for column, values in arrays.items()}
+                piece["cache_code"] = np.full(stop - starts[cache_code], cache_code, dtype=np.int8)
+                pieces.append(piece)
+                starts[cache_code] = stop
+        if not pieces:
+            return None
+        # seq numbers the merged stream without gaps, so every row is scattered straight to its place in the chunk
+        merged = {}
+        for column in ["cache_code", "price", "amount", "servert"]:
+            merged[column] = np.empty(sum(len(piece["seq"]) for piece in pieces), dtype=pieces[0][column].dtype)
+            for piece in pieces:
+                merged[column][piece["seq"] - chunk_start] = piece[column]
+        chunk = pd.DataFrame(
+            {
+                "pair": pd.Categorical.from_codes(merged["cache_code"], meta["pairs"]).set_categories(pairs),
+                "price": merged["price"],
+                "amount": merged["amount"],
+                "servert": merged["servert"],
+            }
+        )
+        chunk["pair_code"] = chunk["pair"].cat.codes
+        return chunk
+
+
+def _cache_path(cache_dir, pair, column):
+    """
+    Return the path of a column file in a binary cache, without extension.
+
+    :param cache_dir: directory of the cache
+    :type cache_dir: str
+    :param pair: pair name of two currencies
+    :type pair: str
+    :param column: column name
+    :type column: str
+    :return: path of the column file
+    :rtype: str
+    """
+    return os.path.join(cache_dir, pair, column)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert book.csv or trades.csv into a binary cache.")
+    parser.add_argument("csv_path", help="path of book.csv or trades.csv")
+    parser.add_argument("cache_dir", help="directory the cache is written to")
+    args = parser.parse_args()
+    build_cache(args.csv_path, args.cache_dir)
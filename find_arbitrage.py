@@ -1,134 +1,324 @@
-from order_book import OrderBook
+import logging
+import math
+from concurrent.futures import ProcessPoolExecutor
+
 import pandas as pd
 
+import metrics
+from book_checkpoint import checkpoint_path, load_checkpoint, load_checkpoint_meta
+from book_set import BookSet
+from currency_graph import CurrencyGraph
+from data_io import PAIRS, read_cache_chunks, read_chunks
+from opportunity_recorder import OpportunityRecorder
+
+logger = logging.getLogger(__name__)
+
+# order book backend used for the replay, see order_book.BOOK_BACKENDS
+BOOK_BACKEND = "rbtree"
+
+
+class ArbitrageScanner:
+    def __init__(self, books, max_length=4, min_return=0, max_return=2, output_path=None, chunk_size=100000):
+        """
+        Instantiate ArbitrageScanner object which enumerates the arbitrage cycles of the pairs up to max_length legs
+        once, and re-evaluates a cycle only when the best bid or best ask of one of its pairs changed. For the default
+        pairs the cycles are the six triangular and rectangular cases, numbered as before. Every new opportunity is
+        recorded with the size executable along the depth of the books, see get_executable. Recorded opportunities are
+        logged at debug level. Updates are routed by pair code, and the cycles read the decoded top of book of the book
+        set.
+
+        :param books: order books of the pairs
+        :type books: book_set.BookSet
+        :param max_length: maximum number of legs in an arbitrage cycle
+        :type max_length: int
+        :param min_return: an opportunity needs a return above this value
+        :type min_return: float
+        :param max_return: an opportunity needs a return below this value
+        :type max_return: float
+        :param output_path: csv or parquet file opportunities are written to in chunks, None to keep them in memory
+        :type output_path: str
+        :param chunk_size: number of opportunities buffered before they are written to output_path
+        :type chunk_size: int
+        """
+        self.books = books
+        # the pairs of the graph are in the order of the codes of the book set, so a pair code is also its index
+        self.graph = CurrencyGraph(books.pairs, max_length)
+        self.min_return = min_return
+        self.max_return = max_return
+        self.recorder = OpportunityRecorder(books.pairs, self.graph.directions, output_path, chunk_size)
+        # metrics are looked up once, so that disabled metrics cost one check per update
+        self.metrics = metrics.active()
+        self.update_counters = ["book_updates." + pair for pair in books.pairs]
+        self.change_counters = ["top_of_book_changes." + pair for pair in books.pairs]
+
+    def update(self, code, price, amount, servert):
+        """
+        Update the order book of a pair and check arbitrage opportunities if its top of book changed.
+
+        :param code: pair code in the book set, see book_set.BookSet.get_codes, negative for pairs outside the set
+        :type code: int
+        :param price: price of a limit order in ticks of the pair, see price_encoding
+        :type price: int
+        :param amount: amount of the limit order in lots of the pair
+        :type amount: int
+        :param servert: time stamp
+        :type servert: float
+        :return: case index, return, executable size, and executable return of each opportunity recorded after the
+            update
+        :rtype: Sequence[tuple]
+        """
+        if code < 0:
+            return ()
+        top_changed = self.books.update(code, price, amount)
+        if self.metrics is not None:
+            self.metrics.count(self.update_counters[code])
+            if top_changed:
+                self.metrics.count(self.change_counters[code])
+        if top_changed:
+            return self.scan(code, servert)
+        return ()
+
+    def scan(self, code, servert):
+        """
+        Re-evaluate the cycles that trade the pair and record the profitable ones.
+
+        :param code: pair code of the pair whose top of book changed
+        :type code: int
+        :param servert: time stamp
+        :type servert: float
+        :return: case index, return, executable size, and executable return of each recorded opportunity
+        :rtype: list
+        """
+        bid_max, ask_min = self.books.top_of_book[code].tolist()
+        cycle_indices, returns = self.graph.update_pair(code, bid_max, ask_min)
+        recorded = []
+        num_in_bounds = 0
+        for case_index, r in zip(cycle_indices.tolist(), returns.round(5).tolist()):
+            if self.min_return < r < self.max_return:
+                num_in_bounds += 1
+                if self.recorder.last_returns[case_index] == r:
+                    # the depth of the books is only walked for opportunities that are not duplicates
+                    self.recorder.record(servert, case_index, r)
+                    continue
+                size, size_return = self.get_executable(case_index)
+                self.recorder.record(servert, case_index, r, size, size_return)
+                recorded.append((case_index, r, size, size_return))
+                logger.debug("case %d: return %s at %s, executable size %s", case_index + 1, r, servert, size)
+        if self.metrics is not None:
+            self.metrics.count("cycle_evaluations", len(cycle_indices))
+            self.metrics.count("opportunities", len(recorded))
+            self.metrics.count("opportunity_duplicates", num_in_bounds - len(recorded))
+        return recorded
+
+    def get_executable(self, case_index):
+        """
+        Walk the price levels of every leg of a cycle from the best price outward, as long as the marginal return of
+        the cycle stays above min_return. Between two level boundaries every leg trades at a fixed price, so the walk
+        steps from one boundary to the next. Levels are read lazily with order_book.BaseOrderBook.iter_levels and
+        decoded one at a time, so only the levels the walk trades are visited.
+
+        :param case_index: index of the cycle
+        :type case_index: int
+        :return: executable size in the currency the cycle starts from, and the average return over it (NaN if the
+            size is 0)
+        :rtype: float, float
+        """
+        legs = []
+        for pair, direction in self.graph.cycles[case_index]:
+            code = self.books.codes[pair]
+            side = "ask" if direction > 0 else "bid"
+            legs.append((direction > 0, self.books.books[code].iter_levels(side), self.books.encodings[code]))
+        # decoded price of the current level of each leg, and the amount left at it in the currency the leg pays
+        prices = [0.0] * len(legs)
+        remaining = [None] * len(legs)
+        size = 0.0
+        proceeds = 0.0
+        while True:
+            # amount paid into each leg and returned by the cycle per unit of the start currency
+            scales = []
+            scale = 1.0
+            for k, (buy, levels, encoding) in enumerate(legs):
+                if remaining[k] is None:
+                    level = next(levels, None)
+                    if level is None:
+                        # the walk ends when a leg runs out of levels
+                        return size, proceeds / size - 1 if size > 0 else math.nan
+                    prices[k] = encoding.decode_prices(level[0])
+                    level_size = encoding.decode_sizes(level[1])
+                    remaining[k] = level_size * prices[k] if buy else level_size
+                scales.append(scale)
+                scale *= 1 / prices[k] if buy else prices[k]
+            if scale - 1 <= self.min_return:
+                return size, proceeds / size - 1 if size > 0 else math.nan
+            # the step ends when the first leg reaches the end of its level
+            steps = [remaining[k] / scales[k] for k in range(len(legs))]
+            step = min(steps)
+            size += step
+            proceeds += step * scale
+            for k in range(len(legs)):
+                remaining[k] = 0.0 if steps[k] == step else remaining[k] - step * scales[k]
+                if remaining[k] <= 0:
+                    remaining[k] = None
+
+    def sync_prices(self):
+        """
+        Set the best prices of all pairs from their order books without recording opportunities, e.g. after the books
+        were restored from a checkpoint.
+
+        :return: None
+        :rtype: NoneType
+        """
+        for code, (bid_max, ask_min) in enumerate(self.books.top_of_book.tolist()):
+            self.graph.update_pair(code, bid_max, ask_min)
+
+    def to_frame(self):
+        """
+        Collect the arbitrage opportunities that have not been written to file into a dataframe.
 
-def find_arbitrage(arb_opp, servert, btc_usd, btc_eur, bch_usd, bch_eur, bch_btc):
+        :return: arbitrage opportunities, one row per opportunity
+        :rtype: pandas.DataFrame
+        """
+        return self.recorder.to_frame()
+
+
+def scan_shard(
+    cache_dir, pairs, path, start_time, stop_time, epoch_offset, backend, max_length, min_return, max_return
+):
     """
-    Find arbitrage opportunities based on five pairs of currencies. Six possible arbitrage cases are hard coded.
-
-    :param arb_opp: dataframe to hold arbitrage opportunity information
-    :type arb_opp: pandas.DataFrame
-    :param servert: time stamp
-    :type servert: float
-    :param btc_usd: OrderBook object for pair of btc_usd
-    :type btc_usd: OrderBook
-    :param btc_eur: OrderBook object for pair of btc_eur
-    :type btc_eur: OrderBook
-    :param bch_usd: OrderBook object for pair of bch_usd
-    :type bch_usd: OrderBook
-    :param bch_eur: OrderBook object for pair of bch_eur
-    :type bch_eur: OrderBook
-    :param bch_btc: OrderBook object for pair of bch_btc
-    :type bch_btc: OrderBook
-    :return:
+    Scan the book data of one time shard for arbitrage, starting from the order books of the checkpoint at its start.
+
+    :param cache_dir: directory of the binary cache of book data
+    :type cache_dir: str
+    :param pairs: pair names of two currencies
+    :type pairs: list
+    :param path: path of the checkpoint at start_time, None to start from empty order books
+    :type path: str
+    :param start_time: only orders after this servert are scanned, None to scan from the start
+    :type start_time: int
+    :param stop_time: only orders at or before this servert are scanned, None to scan to the end
+    :type stop_time: int
+    :param epoch_offset: time subtracted from the original servert, in microseconds
+    :type epoch_offset: int
+    :param backend: name of the order book backend, see order_book.BOOK_BACKENDS
+    :type backend: str
+    :param max_length: maximum number of legs in an arbitrage cycle
+    :type max_length: int
+    :param min_return: an opportunity needs a return above this value
+    :type min_return: float
+    :param max_return: an opportunity needs a return below this value
+    :type max_return: float
+    :return: opportunities recorded in the shard, and the last return within bounds of each case
+    :rtype: pandas.DataFrame, list
     """
-    # triangular arbitrage
-    # ["servert", "return", "BTC-USD", "BTC-EUR", "BCH-USD", "BCH-EUR", "BCH-BTC"]
-    # case 1: USD -> BTC -> BCH -> USD
-    r1 = round((1 / btc_usd.ask_min) / bch_btc.ask_min * bch_usd.bid_max - 1, 5)
-    if r1 > 0 and r1 < 2:
-        opp1 = pd.Series([servert, r1, 1, 1, 0, -1, 0, 1], index=arb_opp.columns)
-        if not opp_exists(arb_opp, 1, r1):
-            arb_opp = arb_opp.append(opp1, ignore_index=True)
-            print("case 1: \n{}".format(opp1))
-
-    # case 2: USD -> BCH -> BTC -> USD
-    r2 = round((1 / bch_usd.ask_min) * bch_btc.bid_max * btc_usd.bid_max - 1, 5)
-    if r2 > 0 and r2 < 2:
-        opp2 = pd.Series([servert, r2, 2, -1, 0, 1, 0, -1], index=arb_opp.columns)
-        # check if updated
-        if not opp_exists(arb_opp, 2, r2):
-            arb_opp = arb_opp.append(opp2, ignore_index=True)
-            print("case 2: \n{}".format(opp2))
-
-    # case 3: EUR -> BTC -> BCH -> EUR
-    r3 = round((1 / btc_eur.ask_min) / bch_btc.ask_min * bch_eur.bid_max - 1, 5)
-    if r3 > 0 and r3 < 2:
-        opp3 = pd.Series([servert, r3, 3, 0, 1, 0, -1, 1], index=arb_opp.columns)
-        if not opp_exists(arb_opp, 3, r3):
-            arb_opp = arb_opp.append(opp3, ignore_index=True)
-            print("case 3: \n{}".format(opp3))
-
-    # case 4: EUR -> BCH -> BTC -> EUR
-    r4 = round((1 / bch_eur.ask_min) * bch_btc.bid_max * btc_eur.bid_max - 1, 5)
-    if r4 > 0 and r4 < 2:
-        opp4 = pd.Series([servert, r4, 4, 0, -1, 0, 1, -1], index=arb_opp.columns)
-        if not opp_exists(arb_opp, 4, r4):
-            arb_opp = arb_opp.append(opp4, ignore_index=True)
-            print("case 4: \n{}".format(opp4))
-
-    # rectangular arbitrage
-    # case 5: USD -> BTC -> EUR -> BCH -> USD
-    r5 = round((1 / btc_usd.ask_min) * btc_eur.bid_max / bch_eur.ask_min * bch_usd.bid_max - 1, 5)
-    if r5 > 0 and r5 < 2:
-        opp5 = pd.Series([servert, r5, 5, 1, -1, -1, 1, 0], index=arb_opp.columns)
-        if not opp_exists(arb_opp, 5, r5):
-            arb_opp = arb_opp.append(opp5, ignore_index=True)
-            print("case 5: \n{}".format(opp5))
-
-    # case 6: USD -> BCH -> EUR -> BTC -> USD
-    r6 = round((1 / bch_usd.ask_min) * bch_eur.bid_max / btc_eur.ask_min * btc_usd.bid_max - 1, 5)
-    if r6 > 0 and r6 < 2:
-        opp6 = pd.Series([servert, r6, 6, -1, 1, 1, -1, 0], index=arb_opp.columns)
-        if not opp_exists(arb_opp, 6, r6):
-            arb_opp = arb_opp.append(opp6, ignore_index=True)
-            print("case 6: \n{}".format(opp6))
-
-    return arb_opp
-
-
-def opp_exists(arb_opp, case_num, r):
+    books = BookSet(pairs, backend) if path is None else load_checkpoint(path, backend)
+    scanner = ArbitrageScanner(books, max_length, min_return, max_return)
+    scanner.sync_prices()
+    book_chunks = read_cache_chunks(
+        cache_dir, pairs, epoch_offset=epoch_offset, start_time=start_time, stop_time=stop_time
+    )
+    for book_chunk in book_chunks:
+        codes, price_ticks, amount_lots = books.encode_chunk(book_chunk)
+        for code, price, amount, servert in zip(
+            codes.tolist(), price_ticks.tolist(), amount_lots.tolist(), book_chunk["servert"].tolist()
+        ):
+            scanner.update(code, price, amount, servert)
+    return scanner.to_frame(), scanner.recorder.last_returns
+
+
+def scan_parallel(
+    cache_dir, checkpoint_dir, backend=BOOK_BACKEND, max_length=4, min_return=0, max_return=2, max_workers=None
+):
     """
-    Check whether the current arbitrage opportunity already exists in the dataframe with same return
-
-    :param arb_opp: dataframe containing arbitrage opportunities found
-    :type arb_opp: pandas.DataFrame
-    :param case_num: the case number of different arbitrage possibilities, range from 1 to 6
-    :type case_num: int
-    :param r: return of current arbitrage
-    :type r: float
-    :return: True iff there exists an identical arbitrage opportunity in the last 8 entries of existing opportunities
-    :rtype: bool
+    Scan a binary cache of book data for arbitrage with one time shard between every two checkpoints, run in a pool
+    of worker processes. The opportunities of the shards are concatenated in time order. A shard does not know the
+    return last recorded for a case before its start, so the first opportunity of each case in a shard is dropped if
+    the sequential scan would have dropped it as a duplicate, which makes the result identical to a sequential scan.
+
+    :param cache_dir: directory of the binary cache of book data
+    :type cache_dir: str
+    :param checkpoint_dir: directory of checkpoints built from the cache by book_checkpoint.build_checkpoints
+    :type checkpoint_dir: str
+    :param backend: name of the order book backend, see order_book.BOOK_BACKENDS
+    :type backend: str
+    :param max_length: maximum number of legs in an arbitrage cycle
+    :type max_length: int
+    :param min_return: an opportunity needs a return above this value
+    :type min_return: float
+    :param max_return: an opportunity needs a return below this value
+    :type max_return: float
+    :param max_workers: number of worker processes, None for the number of cpus
+    :type max_workers: int
+    :return: arbitrage opportunities, one row per opportunity
+    :rtype: pandas.DataFrame
     """
-    # slice last 8 rows from agg_data
-    if len(arb_opp) > 8:
-        temp = arb_opp[len(arb_opp) - 8 : len(arb_opp)]
-    else:
-        temp = arb_opp
-    if len(temp.loc[(temp["case"] == case_num) & (temp["return"] == r)]) > 0:
-        return True
-    else:
-        return False
+    meta = load_checkpoint_meta(checkpoint_dir)
+    bounds = [None] + meta["times"] + [None]
+    paths = [None] + [checkpoint_path(checkpoint_dir, i) for i in range(len(meta["times"]))]
+    shards = [
+        (
+            cache_dir,
+            meta["pairs"],
+            path,
+            start_time,
+            stop_time,
+            meta["epoch_offset"],
+            backend,
+            max_length,
+            min_return,
+            max_return,
+        )
+        for path, start_time, stop_time in zip(paths, bounds[:-1], bounds[1:])
+    ]
+    collect = metrics.active() is not None
+    with ProcessPoolExecutor(max_workers) as executor:
+        futures = [executor.submit(metrics.call_collected, scan_shard, shard, collect) for shard in shards]
+        results = [future.result() for future in futures]
+
+    frames = []
+    last_returns = None
+    for (opportunities, shard_last_returns), shard_metrics in results:
+        metrics.merge(shard_metrics)
+        if last_returns is None:
+            last_returns = shard_last_returns
+        else:
+            first = opportunities.drop_duplicates(subset=["case"])
+            duplicate = first["return"].to_numpy() == [last_returns[case - 1] for case in first["case"]]
+            opportunities = opportunities.drop(index=first.index[duplicate])
+            last_returns = [r if r is not None else last for r, last in zip(shard_last_returns, last_returns)]
+        frames.append(opportunities)
+    return pd.concat(frames, ignore_index=True)
 
 
 if __name__ == "__main__":
-    book_data = pd.read_csv("/Users/ramborghini/Desktop/midpoint/book.csv")
-
-    # instantiate OrderBook objects for four pairs
-    btc_usd = OrderBook()
-    btc_eur = OrderBook()
-    bch_usd = OrderBook()
-    bch_eur = OrderBook()
-    bch_btc = OrderBook()
-
-    arb_opp = pd.DataFrame(columns=["servert", "return", "case", "BTC-USD", "BTC-EUR", "BCH-USD", "BCH-EUR", "BCH-BTC"])
-
-    # loop over book data to construct order books
-    for pair, price, amount, servert in zip(
-        book_data["pair"], book_data["price"], book_data["amount"], book_data["servert"]
-    ):
-        # update order books
-        if pair == "BTC-USD":
-            btc_usd.update_order(price, amount)
-        elif pair == "BTC-EUR":
-            btc_eur.update_order(price, amount)
-        elif pair == "BCH-USD":
-            bch_usd.update_order(price, amount)
-        elif pair == "BCH-EUR":
-            bch_eur.update_order(price, amount)
-        elif pair == "BCH-BTC":
-            bch_btc.update_order(price, amount)
-        # check arbitrage opportunity
-        arb_opp = find_arbitrage(arb_opp, servert, btc_usd, btc_eur, bch_usd, bch_eur, bch_btc)
-
-    arb_opp.to_csv("./data_output/arbitrage_opportunities.csv", index=False)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    # collect metrics of the run with a snapshot every minute, the summary is written next to the output
+    run_metrics = metrics.enable(snapshot_interval=60)
+
+    # csv file, or cache directory built from it with data_io.build_cache
+    book_path = "/Users/ramborghini/Desktop/midpoint/book.csv"
+    # checkpoints built from the cache with book_checkpoint.py, None to scan sequentially
+    checkpoint_dir = None
+    output_path = "./data_output/arbitrage_opportunities.csv"
+
+    if checkpoint_dir is not None:
+        # replay time shards between checkpoints in parallel
+        scan_parallel(book_path, checkpoint_dir).to_csv(output_path, index=False)
+    else:
+        # instantiate OrderBook objects for the pairs
+        books = BookSet(PAIRS, BOOK_BACKEND)
+        scanner = ArbitrageScanner(books, output_path=output_path)
+
+        # stream book data chunk by chunk to construct order books, servert is kept as the original time stamp. the
+        # pairs of a chunk are factorized into pair codes and its prices and amounts are encoded to ticks and lots
+        # once, arbitrage is checked whenever a top of book changes
+        for book_chunk in read_chunks(book_path, epoch_offset=0):
+            codes, price_ticks, amount_lots = books.encode_chunk(book_chunk)
+            for code, price, amount, servert in zip(
+                codes.tolist(), price_ticks.tolist(), amount_lots.tolist(), book_chunk["servert"].tolist()
+            ):
+                scanner.update(code, price, amount, servert)
+            metrics.tick()
+
+        scanner.recorder.close()
+    run_metrics.export("./data_output/metrics_find_arbitrage.json")
+    logger.info("%d opportunities found, metrics written to data_output", run_metrics.counters["opportunities"])
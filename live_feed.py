@@ -0,0 +1,367 @@
+import argparse
+import asyncio
+import logging
+import time
+
+import numpy as np
+
+import metrics
+from data_io import PAIRS, read_chunks
+from book_set import BookSet
+from find_arbitrage import BOOK_BACKEND, ArbitrageScanner
+
+logger = logging.getLogger(__name__)
+
+# number of latencies kept for the percentiles of LatencyStats
+LATENCY_WINDOW = 100000
+
+# number of rows ReplayServer reads and formats at a time, small enough not to hold up the replay of other clients
+REPLAY_CHUNK_SIZE = 4096
+
+
+class ReplayServer:
+    def __init__(self, book_path, speed=1.0, host="127.0.0.1", port=0):
+        """
+        Instantiate ReplayServer object which serves book data over TCP as a local stand-in for an exchange feed. Each
+        client is sent the whole book data from the start as lines of "pair,price,amount,servert", paced by servert.
+        Writes wait for the client to drain its socket, so a slow client slows down the replay.
+
+        :param book_path: csv file of book data, or cache directory built from it with data_io.build_cache
+        :type book_path: str
+        :param speed: replay speed as a multiple of real time, None to send as fast as the client reads
+        :type speed: float
+        :param host: address the server listens on
+        :type host: str
+        :param port: port the server listens on, 0 for any free port
+        :type port: int
+        """
+        self.book_path = book_path
+        self.speed = speed
+        self.host = host
+        self.port = port
+        self.server = None
+
+    async def start(self):
+        """
+        Start listening, port is set to the port actually bound.
+
+        :return: None
+        :rtype: NoneType
+        """
+        self.server = await asyncio.start_server(self._serve, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        """
+        Stop listening and wait until the server is closed.
+
+        :return: None
+        :rtype: NoneType
+        """
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def _serve(self, reader, writer):
+        """
+        Replay the book data to one client and close the connection at the end. Chunks are read and formatted in the
+        default executor, so that the event loop only writes lines.
+
+        :param reader: stream of the client, unused
+        :type reader: asyncio.StreamReader
+        :param writer: stream to the client
+        :type writer: asyncio.StreamWriter
+        :return: None
+        :rtype: NoneType
+        """
+        loop = asyncio.get_running_loop()
+        start_clock = loop.time()
+        first_servert = None
+        book_chunks = read_chunks(self.book_path, chunksize=REPLAY_CHUNK_SIZE, epoch_offset=0)
+        try:
+            while True:
+                chunk_lines = await loop.run_in_executor(None, _format_next_chunk, book_chunks)
+                if chunk_lines is None:
+                    break
+                servert, lines = chunk_lines
+                if not lines:
+                    continue
+                if first_servert is None:
+                    first_servert = servert[0]
+                if self.speed is None:
+                    due = np.zeros(len(lines))
+                else:
+                    # seconds after the start of the replay at which each line is sent
+                    due = (servert - first_servert) / (1000000 * self.speed)
+                sent = 0
+                while sent < len(lines):
+                    stop = int(np.searchsorted(due, loop.time() - start_clock, side="right"))
+                    if stop == sent:
+                        await asyncio.sleep(due[sent] - (loop.time() - start_clock))
+                        continue
+                    writer.write("".join(lines[sent:stop]).encode())
+                    await writer.drain()
+                    sent = stop
+        except ConnectionError:
+            # the client went away before the end of the replay
+            pass
+        finally:
+            writer.close()
+
+
+def _format_next_chunk(book_chunks):
+    """
+    Read the next chunk of book data and format its rows as lines of "pair,price,amount,servert".
+
+    :param book_chunks: chunks of book data, see data_io.read_chunks
+    :type book_chunks: Iterator[pandas.DataFrame]
+    :return: servert of each row and its line, None once book data depletes
+    :rtype: (numpy.ndarray, list) or NoneType
+    """
+    book_chunk = next(book_chunks, None)
+    if book_chunk is None:
+        return None
+    servert = book_chunk["servert"].to_numpy()
+    lines = [
+        "{},{!r},{!r},{}\n".format(pair, price, amount, t)
+        for pair, price, amount, t in zip(
+            book_chunk["pair"], book_chunk["price"].tolist(), book_chunk["amount"].tolist(), servert.tolist()
+        )
+    ]
+    return servert, lines
+
+
+async def tcp_source(host, port):
+    """
+    Read book updates from a feed of lines of "pair,price,amount,servert" over TCP, such as a ReplayServer.
+
+    :param host: address of the feed
+    :type host: str
+    :param port: port of the feed
+    :type port: int
+    :return: pair, price, amount, and servert of each update
+    :rtype: AsyncIterator[tuple]
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            pair, price, amount, servert = line.decode().split(",")
+            yield pair, float(price), float(amount), int(servert)
+    finally:
+        writer.close()
+
+
+async def log_sink(opportunity):
+    """
+    Log an arbitrage opportunity at info level.
+
+    :param opportunity: servert, return, case, direction of each pair, and executable size and return
+    :type opportunity: dict
+    :return: None
+    :rtype: NoneType
+    """
+    logger.info("case %d: return %s at %s", opportunity["case"], opportunity["return"], opportunity["servert"])
+
+
+class LatencyStats:
+    def __init__(self, window=LATENCY_WINDOW):
+        """
+        Instantiate LatencyStats object which counts latencies and keeps the most recent ones for percentiles, so that
+        memory stays bounded in a long running service.
+
+        :param window: number of most recent latencies kept
+        :type window: int
+        """
+        self.latencies = np.zeros(window)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, latency):
+        """
+        Add the latency of one message.
+
+        :param latency: latency in seconds
+        :type latency: float
+        :return: None
+        :rtype: NoneType
+        """
+        self.latencies[self.count % len(self.latencies)] = latency
+        self.count += 1
+        self.total += latency
+        if latency > self.max:
+            self.max = latency
+
+    def summary(self):
+        """
+        Summarize the latencies in microseconds, percentiles are over the most recent window.
+
+        :return: count, mean, median, 99th percentile, and maximum
+        :rtype: dict
+        """
+        recent = self.latencies[: min(self.count, len(self.latencies))] * 1000000
+        p50, p99 = np.percentile(recent, [50, 99]).tolist() if len(recent) else (np.nan, np.nan)
+        return {
+            "count": self.count,
+            "mean_us": self.total / self.count * 1000000 if self.count else np.nan,
+            "p50_us": p50,
+            "p99_us": p99,
+            "max_us": self.max * 1000000,
+        }
+
+
+class LiveArbitrageService:
+    def __init__(self, scanner, sink=log_sink, queue_size=10000):
+        """
+        Instantiate LiveArbitrageService object which applies a stream of book updates to the order books of an
+        ArbitrageScanner and emits every recorded opportunity to an async sink. Updates and opportunities pass through
+        bounded queues: a full update queue stops reading from the source, and a slow sink stops the processing of
+        updates once the opportunity queue is full. The latency of each update is measured from its receipt until it is
+        applied and scanned, the latency of each opportunity until the sink finished with it.
+
+        :param scanner: scanner holding the order books
+        :type scanner: find_arbitrage.ArbitrageScanner
+        :param sink: coroutine function called with each opportunity as a dict of servert, return, case, direction of
+            each pair, and executable size and return
+        :type sink: Callable
+        :param queue_size: maximum number of updates and of opportunities waiting in their queues
+        :type queue_size: int
+        """
+        self.scanner = scanner
+        self.sink = sink
+        self.queue_size = queue_size
+        self.update_latency = LatencyStats()
+        self.opportunity_latency = LatencyStats()
+
+    async def run(self, source):
+        """
+        Consume a source of book updates until it is exhausted and all opportunities reached the sink.
+
+        :param source: pair, price, amount, and servert of each update
+        :type source: AsyncIterable[tuple]
+        :return: None
+        :rtype: NoneType
+        """
+        # queues are created here so that they belong to the running event loop
+        updates = asyncio.Queue(self.queue_size)
+        opportunities = asyncio.Queue(self.queue_size)
+        tasks = [
+            asyncio.create_task(self._receive(source, updates)),
+            asyncio.create_task(self._process(updates, opportunities)),
+            asyncio.create_task(self._emit(opportunities)),
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _receive(self, source, updates):
+        """
+        Time stamp each update of the source on receipt and queue it, None marks the end of the source.
+
+        :param source: pair, price, amount, and servert of each update
+        :type source: AsyncIterable[tuple]
+        :param updates: queue of received updates
+        :type updates: asyncio.Queue
+        :return: None
+        :rtype: NoneType
+        """
+        async for update in source:
+            await updates.put((time.perf_counter(), update))
+        await updates.put(None)
+
+    async def _process(self, updates, opportunities):
+        """
+        Apply queued updates to the order books and queue the recorded opportunities. Pairs of the feed are looked up
+        as pair codes and decimal prices and amounts are encoded to the ticks and lots of the books here, updates of
+        pairs outside the book set are dropped.
+
+        :param updates: queue of received updates
+        :type updates: asyncio.Queue
+        :param opportunities: queue of opportunities for the sink
+        :type opportunities: asyncio.Queue
+        :return: None
+        :rtype: NoneType
+        """
+        books = self.scanner.books
+        columns = self.scanner.recorder.columns
+        directions = self.scanner.graph.directions.tolist()
+        while True:
+            item = await updates.get()
+            if item is None:
+                await opportunities.put(None)
+                return
+            received, (pair, price, amount, servert) = item
+            code = books.codes.get(pair, -1)
+            if code >= 0:
+                encoding = books.encodings[code]
+                price, amount = encoding.encode_price(price), encoding.encode_size(amount)
+            for case_index, r, size, size_return in self.scanner.update(code, price, amount, servert):
+                values = [servert, r, case_index + 1] + directions[case_index] + [size, size_return]
+                opportunity = dict(zip(columns, values))
+                await opportunities.put((received, opportunity))
+            self.update_latency.add(time.perf_counter() - received)
+            metrics.tick()
+
+    async def _emit(self, opportunities):
+        """
+        Pass queued opportunities to the sink.
+
+        :param opportunities: queue of opportunities for the sink
+        :type opportunities: asyncio.Queue
+        :return: None
+        :rtype: NoneType
+        """
+        while True:
+            item = await opportunities.get()
+            if item is None:
+                return
+            received, opportunity = item
+            await self.sink(opportunity)
+            self.opportunity_latency.add(time.perf_counter() - received)
+
+
+async def run_replay(book_path, speed=1.0, output_path=None, backend=BOOK_BACKEND):
+    """
+    Replay book data through a local ReplayServer into a LiveArbitrageService.
+
+    :param book_path: csv file of book data, or cache directory built from it with data_io.build_cache
+    :type book_path: str
+    :param speed: replay speed as a multiple of real time, None to send as fast as the service reads
+    :type speed: float
+    :param output_path: csv or parquet file the opportunities are written to, None to keep them in memory
+    :type output_path: str
+    :param backend: name of the order book backend, see order_book.BOOK_BACKENDS
+    :type backend: str
+    :return: the service after the replay, holding the scanner and the latency statistics
+    :rtype: LiveArbitrageService
+    """
+    server = ReplayServer(book_path, speed)
+    await server.start()
+    scanner = ArbitrageScanner(BookSet(PAIRS, backend), output_path=output_path)
+    service = LiveArbitrageService(scanner)
+    try:
+        await service.run(tcp_source(server.host, server.port))
+    finally:
+        scanner.recorder.close()
+        await server.close()
+    return service
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scan a local replay of book data for arbitrage as a live feed.")
+    parser.add_argument("book_path", help="csv file of book data, or cache directory built from it")
+    parser.add_argument("--speed", type=float, default=1.0, help="multiple of real time, 0 to replay without pacing")
+    parser.add_argument("--output", default=None, help="csv or parquet file the opportunities are written to")
+    parser.add_argument("--metrics", default=None, help="json file metrics are written to, with a snapshot a minute")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    run_metrics = metrics.enable(snapshot_interval=60) if args.metrics else None
+    live_service = asyncio.run(run_replay(args.book_path, args.speed or None, args.output))
+    logger.info("update latency: %s", live_service.update_latency.summary())
+    logger.info("opportunity latency: %s", live_service.opportunity_latency.summary())
+    if run_metrics is not None:
+        run_metrics.export(args.metrics)
@@ -0,0 +1,244 @@
+import json
+import logging
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# metrics of the running process, None while metrics are disabled
+_active = None
+
+
+class Metrics:
+    def __init__(self, snapshot_interval=None):
+        """
+        Instantiate Metrics object which counts events and accumulates the time spent in stages of a run. With a
+        snapshot interval, tick records a copy of the metrics at most once per interval and logs it.
+
+        :param snapshot_interval: seconds between two snapshots, None for no snapshots
+        :type snapshot_interval: float
+        """
+        self.counters = Counter()
+        # number of calls and total seconds of each timed stage
+        self.timers = {}
+        self.start_time = time.perf_counter()
+        self.snapshot_interval = snapshot_interval
+        self.next_snapshot = self.start_time + snapshot_interval if snapshot_interval else None
+        self.snapshots = []
+
+    def count(self, name, n=1):
+        """
+        Add n to a counter.
+
+        :param name: name of the counter
+        :type name: str
+        :param n: number of events
+        :type n: int
+        :return: None
+        :rtype: NoneType
+        """
+        self.counters[name] += n
+
+    def add_time(self, name, seconds):
+        """
+        Add one call of a stage that took seconds.
+
+        :param name: name of the stage
+        :type name: str
+        :param seconds: time taken
+        :type seconds: float
+        :return: None
+        :rtype: NoneType
+        """
+        calls_seconds = self.timers.setdefault(name, [0, 0.0])
+        calls_seconds[0] += 1
+        calls_seconds[1] += seconds
+
+    @contextmanager
+    def timer(self, name):
+        """
+        Time the body of a with statement as one call of a stage.
+
+        :param name: name of the stage
+        :type name: str
+        :return: context manager
+        :rtype: contextlib.AbstractContextManager
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def tick(self):
+        """
+        Record and log a snapshot if the snapshot interval passed since the last one.
+
+        :return: None
+        :rtype: NoneType
+        """
+        if self.next_snapshot is not None and time.perf_counter() >= self.next_snapshot:
+            snapshot = self.summary()
+            self.snapshots.append(snapshot)
+            logger.info("metrics snapshot: %s", json.dumps(snapshot))
+            self.next_snapshot = time.perf_counter() + self.snapshot_interval
+
+    def summary(self):
+        """
+        Summarize the metrics so far.
+
+        :return: elapsed seconds, counters, and calls and seconds of each stage
+        :rtype: dict
+        """
+        return {
+            "elapsed_seconds": time.perf_counter() - self.start_time,
+            "counters": dict(sorted(self.counters.items())),
+            "timers": {
+                name: {"calls": calls, "seconds": seconds} for name, (calls, seconds) in sorted(self.timers.items())
+            },
+        }
+
+    def merge(self, summary):
+        """
+        Add the counters and stages of a summary, e.g. of a worker process, to these metrics.
+
+        :param summary: summary returned by Metrics.summary
+        :type summary: dict
+        :return: None
+        :rtype: NoneType
+        """
+        self.counters.update(summary["counters"])
+        for name, stage in summary["timers"].items():
+            calls_seconds = self.timers.setdefault(name, [0, 0.0])
+            calls_seconds[0] += stage["calls"]
+            calls_seconds[1] += stage["seconds"]
+
+    def export(self, path):
+        """
+        Write the summary and the snapshots to a json file.
+
+        :param path: path of the json file
+        :type path: str
+        :return: None
+        :rtype: NoneType
+        """
+        with open(path, "w") as metrics_file:
+            json.dump({"summary": self.summary(), "snapshots": self.snapshots}, metrics_file, indent=2)
+
+
+def enable(snapshot_interval=None):
+    """
+    Start collecting metrics in this process. Objects look up the metrics when they are created, so metrics are
+    enabled before a run is set up.
+
+    :param snapshot_interval: seconds between two snapshots, None for no snapshots
+    :type snapshot_interval: float
+    :return: the metrics collected from now on
+    :rtype: Metrics
+    """
+    global _active
+    _active = Metrics(snapshot_interval)
+    return _active
+
+
+def disable():
+    """
+    Stop collecting metrics in this process.
+
+    :return: None
+    :rtype: NoneType
+    """
+    global _active
+    _active = None
+
+
+def active():
+    """
+    Return the metrics being collected.
+
+    :return: the metrics, None while metrics are disabled
+    :rtype: Metrics
+    """
+    return _active
+
+
+def count(name, n=1):
+    """
+    Add n to a counter of the active metrics, nothing happens while metrics are disabled.
+
+    :param name: name of the counter
+    :type name: str
+    :param n: number of events
+    :type n: int
+    :return: None
+    :rtype: NoneType
+    """
+    if _active is not None:
+        _active.count(name, n)
+
+
+@contextmanager
+def timer(name):
+    """
+    Time the body of a with statement as one call of a stage of the active metrics, nothing is timed while metrics
+    are disabled.
+
+    :param name: name of the stage
+    :type name: str
+    :return: context manager
+    :rtype: contextlib.AbstractContextManager
+    """
+    if _active is None:
+        yield
+    else:
+        with _active.timer(name):
+            yield
+
+
+def tick():
+    """
+    Give the active metrics the chance to record a periodic snapshot.
+
+    :return: None
+    :rtype: NoneType
+    """
+    if _active is not None:
+        _active.tick()
+
+
+def merge(summary):
+    """
+    Add a summary of metrics, e.g. of a worker process, to the active metrics, nothing happens while metrics are
+    disabled or if summary is None.
+
+    :param summary: summary returned by Metrics.summary
+    :type summary: dict
+    :return: None
+    :rtype: NoneType
+    """
+    if _active is not None and summary is not None:
+        _active.merge(summary)
+
+
+def call_collected(func, args, collect):
+    """
+    Call func in a worker process and collect the metrics of the call, so that they can be merged into the metrics
+    of the parent process.
+
+    :param func: function picklable by a process pool
+    :type func: Callable
+    :param args: positional arguments of func
+    :type args: tuple
+    :param collect: whether metrics are collected
+    :type collect: bool
+    :return: result of func, and summary of its metrics (None if not collected)
+    :rtype: Any, dict
+    """
+    if not collect:
+        return func(*args), None
+    worker_metrics = enable()
+    try:
+        return func(*args), worker_metrics.summary()
+    finally:
+        disable()
@@ -0,0 +1,158 @@
+import numpy as np
+import pandas as pd
+
+import metrics
+
+
+class OpportunityRecorder:
+    def __init__(self, pairs, directions, path=None, chunk_size=100000):
+        """
+        Instantiate OpportunityRecorder object which appends arbitrage opportunities to preallocated column buffers.
+        Only time stamp, return, executable size and return, and case are stored per opportunity, the direction of each
+        pair is looked up from the case when the buffer is flushed. With a path, the buffer is written to file whenever
+        chunk_size opportunities are held, otherwise it grows in memory.
+
+        :param pairs: pair names of two currencies, in the layout of the opportunity table
+        :type pairs: list
+        :param directions: direction of each pair in each case, one row per case
+        :type directions: numpy.ndarray
+        :param path: csv or parquet file the opportunities are written to, None to keep them in memory
+        :type path: str
+        :param chunk_size: number of opportunities held before the buffer is flushed to file
+        :type chunk_size: int
+        """
+        self.pairs = list(pairs)
+        self.directions = np.asarray(directions)
+        # executable size and return follow the pairs, so the columns of earlier outputs keep their positions
+        self.columns = ["servert", "return", "case"] + self.pairs + ["executable_size", "executable_return"]
+        self.path = path
+        self.chunk_size = chunk_size
+        self.servert = np.empty(chunk_size, dtype=np.int64)
+        self.returns = np.empty(chunk_size)
+        self.executable_sizes = np.empty(chunk_size)
+        self.executable_returns = np.empty(chunk_size)
+        self.cases = np.empty(chunk_size, dtype=np.int64)
+        self.size = 0
+        self.num_flushed = 0
+        self.num_duplicates = 0
+        # return of the last recorded opportunity of each case, an opportunity with an unchanged return is a duplicate
+        self.last_returns = [None] * len(self.directions)
+        self._parquet_writer = None
+
+    def __len__(self):
+        """
+        Return the number of opportunities recorded so far, including those flushed to file
+
+        :return: number of recorded opportunities
+        :rtype: int
+        """
+        return self.num_flushed + self.size
+
+    def record(self, servert, case_index, r, executable_size=np.nan, executable_return=np.nan):
+        """
+        Record an arbitrage opportunity unless its case was last recorded with the same return.
+
+        :param servert: time stamp
+        :type servert: int
+        :param case_index: index of the case, the case number is case_index + 1
+        :type case_index: int
+        :param r: return of the arbitrage
+        :type r: float
+        :param executable_size: size executable above the minimum return, in the currency the case starts from
+        :type executable_size: float
+        :param executable_return: average return over the executable size
+        :type executable_return: float
+        :return: True iff the opportunity was recorded
+        :rtype: bool
+        """
+        if self.last_returns[case_index] == r:
+            self.num_duplicates += 1
+            return False
+        self.last_returns[case_index] = r
+        if self.size == len(self.servert):
+            if self.path is None:
+                self._grow()
+            else:
+                self.flush()
+        self.servert[self.size] = servert
+        self.returns[self.size] = r
+        self.executable_sizes[self.size] = executable_size
+        self.executable_returns[self.size] = executable_return
+        self.cases[self.size] = case_index + 1
+        self.size += 1
+        return True
+
+    def to_frame(self):
+        """
+        Collect the opportunities held in the buffer into a dataframe.
+
+        :return: arbitrage opportunities, one row per opportunity
+        :rtype: pandas.DataFrame
+        """
+        data = {
+            "servert": self.servert[: self.size],
+            "return": self.returns[: self.size],
+            "executable_size": self.executable_sizes[: self.size],
+            "executable_return": self.executable_returns[: self.size],
+            "case": self.cases[: self.size],
+        }
+        pair_directions = self.directions[self.cases[: self.size] - 1]
+        for i, pair in enumerate(self.pairs):
+            data[pair] = pair_directions[:, i]
+        return pd.DataFrame(data, columns=self.columns)
+
+    def flush(self):
+        """
+        Write the opportunities held in the buffer to file and empty the buffer. The first flush overwrites the file.
+
+        :return: None
+        :rtype: NoneType
+        """
+        if self.path is None:
+            return
+        with metrics.timer("opportunity_write"):
+            chunk = self.to_frame()
+            if self.path.endswith(".parquet"):
+                if self._parquet_writer is None:
+                    # pyarrow is only needed when writing parquet
+                    import pyarrow as pa
+                    import pyarrow.parquet as pq
+
+                    table = pa.Table.from_pandas(chunk, preserve_index=False)
+                    self._parquet_writer = pq.ParquetWriter(self.path, table.schema)
+                else:
+                    import pyarrow as pa
+
+                    table = pa.Table.from_pandas(chunk, schema=self._parquet_writer.schema, preserve_index=False)
+                self._parquet_writer.write_table(table)
+            else:
+                chunk.to_csv(self.path, mode="a" if self.num_flushed else "w", header=not self.num_flushed, index=False)
+        self.num_flushed += self.size
+        self.size = 0
+
+    def close(self):
+        """
+        Flush the remaining opportunities and close the output file.
+
+        :return: None
+        :rtype: NoneType
+        """
+        if self.path is not None and (self.size or not self.num_flushed):
+            self.flush()
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+            self._parquet_writer = None
+
+    def _grow(self):
+        """
+        Double the capacity of the in-memory buffer.
+
+        :return: None
+        :rtype: NoneType
+        """
+        capacity = 2 * len(self.servert)
+        self.servert = np.resize(self.servert, capacity)
+        self.returns = np.resize(self.returns, capacity)
+        self.executable_sizes = np.resize(self.executable_sizes, capacity)
+        self.executable_returns = np.resize(self.executable_returns, capacity)
+        self.cases = np.resize(self.cases, capacity)
@@ -1,27 +1,45 @@
 from bintrees.rbtree import RBTree
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import deque
+from itertools import islice
+import numpy as np
 import math
+import random
 
+# width of the liquidity band in multiples of the spread
+LIQUIDITY_MULTIPLIER = 2
+
+
+class BaseOrderBook:
+    """
+    Common interface of the OrderBook backends. Subclasses keep bid_max and ask_min up to date in update_order. Prices
+    are integer ticks and sizes integer lots of the pair, see price_encoding.
+    """
 
-class OrderBook:
     def __init__(self):
         """
-        Instantiate OrderBook object which uses RBTree as main data structure
+        Instantiate the state shared by the backends: extremes of both sides and liquidity bands.
         """
-        self.bids = RBTree()
-        self.asks = RBTree()
-        # keep track of max and min for bid and ask orders respectively
-        self.bid_max = -math.inf
-        self.bid_min = math.inf
-        self.ask_max = -math.inf
-        self.ask_min = math.inf
+        # best and worst prices of each side, NaN when a side is empty
+        self.bid_max = math.nan
+        self.bid_min = math.nan
+        self.ask_max = math.nan
+        self.ask_min = math.nan
+        # memoized liquidity bands keyed by multiplier as [lower bound bid, upper bound ask, bid and ask liquidity]
+        self.liquidity_bands = {}
+        self.bid_band_floor = math.inf
+        self.ask_band_ceiling = -math.inf
 
     def __repr__(self):
         """
-        Return a string representation of OrderBook object
+        Return a string representation of the order book
 
-        :return: a string describing OrderBook object
+        :return: a string describing the order book
         :rtype: str
         """
+        bid_prices, bid_sizes = self._get_side("bid")
+        ask_prices, ask_sizes = self._get_side("ask")
         return (
             "Bids Representation: \n"
             "{}\n"
@@ -30,10 +48,170 @@ class OrderBook:
             "Current best bid price is {}\n"
             "Current best ask price is {}\n"
             "Current bid-ask spread is {}".format(
-                str(self.bids), str(self.asks), str(self.bid_max), str(self.ask_min), str(self.get_spread())
+                dict(zip(bid_prices.tolist(), bid_sizes.tolist())),
+                dict(zip(ask_prices.tolist(), ask_sizes.tolist())),
+                str(self.bid_max),
+                str(self.ask_min),
+                str(self.get_spread()),
             )
         )
 
+    def get_spread(self):
+        """
+        Calculate the spread from best bid and ask
+
+        :return: current spread on OrderBook
+        :rtype: float
+        """
+        return self.ask_min - self.bid_max
+
+    def get_midpoint(self):
+        """
+        Calculate mid point price from best bid and ask
+
+        :return: current mid point price
+        :rtype: float
+        """
+        return (self.ask_min + self.bid_max) / 2
+
+    def get_liquidity(self, multiplier=LIQUIDITY_MULTIPLIER):
+        """
+        Calculate the liquidity for both bid and ask side. Total volume of liquidity quoted on bids and asks within
+        multiplier times the spread from the best bid and the best ask, in lots of the base currency. The sums of each
+        band are memoized: updates inside a band shift its sums by the change in size, updates outside leave them as
+        they are, and a change of best bid or ask, which moves every band, drops them.
+
+        :param multiplier: width of the bands in multiples of the spread
+        :type multiplier: float
+        :return: current bid and ask liquidity, NaN when either side is empty
+        :rtype: float, float
+        """
+        band = self.liquidity_bands.get(multiplier)
+        if band is None:
+            spread = self.get_spread()
+            if math.isnan(spread):
+                return math.nan, math.nan
+            # bids at or above the lower bound, asks at or below the upper bound
+            lower_bound_bid = self.bid_max - multiplier * spread
+            upper_bound_ask = self.ask_min + multiplier * spread
+            band = [lower_bound_bid, upper_bound_ask, *self._sum_band(lower_bound_bid, upper_bound_ask)]
+            self.liquidity_bands[multiplier] = band
+            self.bid_band_floor = min(self.bid_band_floor, lower_bound_bid)
+            self.ask_band_ceiling = max(self.ask_band_ceiling, upper_bound_ask)
+        return band[2], band[3]
+
+    def _shift_bands(self, side, price, change):
+        """
+        Add the change in size of a price level to the memoized liquidity bands holding the level.
+
+        :param side: 0 for a bid level, 1 for an ask level
+        :type side: int
+        :param price: price of the level
+        :type price: float
+        :param change: new size minus old size of the level
+        :type change: float
+        :return: None
+        :rtype: NoneType
+        """
+        for band in self.liquidity_bands.values():
+            if (price >= band[0]) if side == 0 else (price <= band[1]):
+                band[side + 2] += change
+
+    def _clear_bands(self):
+        """
+        Drop the memoized liquidity bands, e.g. after the best bid or ask changed.
+
+        :return: None
+        :rtype: NoneType
+        """
+        self.liquidity_bands = {}
+        # updates below the floor of the bids or above the ceiling of the asks leave every band unchanged
+        self.bid_band_floor = math.inf
+        self.ask_band_ceiling = -math.inf
+
+    def apply_updates(self, prices, amounts, checkpoints=()):
+        """
+        Apply a block of updates in order with the same rules as update_order. The arrays are converted to Python
+        ints once and fed to update_order by C-level iteration, top of book is only read at the checkpoints.
+
+        :param prices: prices of the limit orders in ticks
+        :type prices: numpy.ndarray
+        :param amounts: amounts of the limit orders in lots
+        :type amounts: numpy.ndarray
+        :param checkpoints: ascending indices into the block, top of book is recorded right after these updates
+        :type checkpoints: numpy.ndarray
+        :return: best bid and best ask at each checkpoint, one row per checkpoint
+        :rtype: numpy.ndarray
+        """
+        prices = np.asarray(prices, dtype=np.int64).tolist()
+        amounts = np.asarray(amounts, dtype=np.int64).tolist()
+        update_order = self.update_order
+        top_of_book = np.empty((len(checkpoints), 2))
+        start = 0
+        for row, checkpoint in enumerate(checkpoints):
+            stop = int(checkpoint) + 1
+            # exhaust the map iterator without keeping its results
+            deque(map(update_order, prices[start:stop], amounts[start:stop]), maxlen=0)
+            top_of_book[row] = self.bid_max, self.ask_min
+            start = max(start, stop)
+        deque(map(update_order, prices[start:], amounts[start:]), maxlen=0)
+        return top_of_book
+
+    def to_arrays(self):
+        """
+        Copy the price levels of both sides into arrays, a compact snapshot of the order book.
+
+        :return: bid prices, bid sizes, ask prices, and ask sizes in ascending order of price, keyed by name
+        :rtype: dict
+        """
+        bid_prices, bid_sizes = self._get_side("bid")
+        ask_prices, ask_sizes = self._get_side("ask")
+        return {"bid_prices": bid_prices, "bid_sizes": bid_sizes, "ask_prices": ask_prices, "ask_sizes": ask_sizes}
+
+    @classmethod
+    def from_arrays(cls, bid_prices, bid_sizes, ask_prices, ask_sizes):
+        """
+        Restore an order book from the price levels of both sides, as returned by to_arrays.
+
+        :param bid_prices: bid prices in ticks in ascending order
+        :type bid_prices: numpy.ndarray
+        :param bid_sizes: size in lots of each bid price level
+        :type bid_sizes: numpy.ndarray
+        :param ask_prices: ask prices in ticks in ascending order
+        :type ask_prices: numpy.ndarray
+        :param ask_sizes: size in lots of each ask price level
+        :type ask_sizes: numpy.ndarray
+        :return: an order book holding the price levels
+        :rtype: BaseOrderBook
+        """
+        book = cls()
+        # levels are inserted in ascending order, which appends to the sorted buffers of ArrayOrderBook
+        book.apply_updates(bid_prices, bid_sizes)
+        book.apply_updates(ask_prices, -np.asarray(ask_sizes, dtype=np.int64))
+        return book
+
+
+class OrderBook(BaseOrderBook):
+    def __init__(self, cache_depth=5):
+        """
+        Instantiate OrderBook object which uses RBTree as main data structure
+
+        :param cache_depth: number of best price levels per side cached outside of the RBTree
+        :type cache_depth: int
+        """
+        super().__init__()
+        self.bids = RBTree()
+        self.asks = RBTree()
+        # best price levels of each side in ascending order of price with their sizes. Every level of a side that is not
+        # cached is worse than the bound of the cache, so the RBTree is only searched when a cache runs empty
+        self.cache_depth = cache_depth
+        self.bid_cache_prices = []
+        self.bid_cache_sizes = []
+        self.bid_cache_bound = -math.inf
+        self.ask_cache_prices = []
+        self.ask_cache_sizes = []
+        self.ask_cache_bound = math.inf
+
     def __eq__(self, other):
         """
         Return True iff self and other have exactly the same bids and asks attributes
@@ -47,100 +225,443 @@ class OrderBook:
             return False
         return self.bids == other.bids and self.asks == other.asks
 
-    def get_spread(self):
+    def _sum_band(self, lower_bound_bid, upper_bound_ask):
         """
-        Calculate the spread from best bid and ask
+        Sum the sizes of the bids at or above lower_bound_bid and of the asks at or below upper_bound_ask.
 
-        :return: current spread on OrderBook
-        :rtype: float
+        :param lower_bound_bid: lowest bid price in the band
+        :type lower_bound_bid: float
+        :param upper_bound_ask: highest ask price in the band
+        :type upper_bound_ask: float
+        :return: bid and ask liquidity
+        :rtype: float, float
         """
-        return self.ask_min - self.bid_max
+        # get orders in the liquidity range using TreeSlice, open ended towards the best price. TreeSlice excludes its
+        # end, so the ask level at the upper bound is added separately
+        bid_liquidity = sum(self.bids[lower_bound_bid:].values())
+        ask_liquidity = sum(self.asks[:upper_bound_ask].values()) + self.asks.get(upper_bound_ask, 0)
+        return bid_liquidity, ask_liquidity
 
-    def get_midpoint(self):
+    def _get_side(self, side):
         """
-        Calculate mid point price from best bid and ask
+        Copy the price levels of one side into arrays.
 
-        :return: current mid point price
-        :rtype: float
+        :param side: "bid" or "ask"
+        :type side: str
+        :return: prices in ascending order and their sizes
+        :rtype: numpy.ndarray, numpy.ndarray
         """
-        return (self.ask_min + self.bid_max) / 2
+        tree = self.bids if side == "bid" else self.asks
+        return (
+            np.fromiter(tree.keys(), dtype=np.int64, count=len(tree)),
+            np.fromiter(tree.values(), dtype=np.int64, count=len(tree)),
+        )
 
-    def get_liquidity(self):
+    def iter_levels(self, side):
         """
-        Calculate the liquidity for both bid and ask side. Total volume of liquidity quoted on bids and asks within 2x
-        the spread from the best bid and the best ask, in units of the base currency.
+        Iterate over the price levels of one side from the best price outward, without copying the side. Finding the
+        best level takes O(log(n)), each further level O(1) amortized. The book must not change during the iteration.
 
-        :return: current bid and ask liquidity
-        :rtype: float, float
+        :param side: "bid" or "ask"
+        :type side: str
+        :return: price and size of each level
+        :rtype: Iterator[tuple]
         """
-        spread = self.get_spread()
-        lower_bound_bid = self.bid_max - 2 * spread
-        upper_bound_ask = self.ask_min + 2 * spread
-        # get orders in the liquidity range using TreeSlice
-        liquidity_bids_tree = self.bids[lower_bound_bid : self.bid_max + 1]
-        liquidity_asks_tree = self.asks[self.ask_min : upper_bound_ask]
-        bid_liquidity = sum(liquidity_bids_tree.values())
-        ask_liquidity = sum(liquidity_asks_tree.values())
-        return bid_liquidity, ask_liquidity
+        if side == "bid":
+            return iter(self.bids.iter_items(reverse=True))
+        return iter(self.asks.iter_items())
+
+    def get_top_levels(self, n):
+        """
+        Get the best n price levels of each side, served from the cache when it holds enough levels.
+
+        :param n: number of price levels per side
+        :type n: int
+        :return: (price, size) of the best bids in descending and of the best asks in ascending order of price
+        :rtype: list, list
+        """
+        if n <= len(self.bid_cache_prices) or len(self.bid_cache_prices) == len(self.bids):
+            top_bids = list(zip(self.bid_cache_prices[::-1], self.bid_cache_sizes[::-1]))[:n]
+        else:
+            top_bids = self.bids.nlargest(n)
+        if n <= len(self.ask_cache_prices) or len(self.ask_cache_prices) == len(self.asks):
+            top_asks = list(zip(self.ask_cache_prices, self.ask_cache_sizes))[:n]
+        else:
+            top_asks = self.asks.nsmallest(n)
+        return top_bids, top_asks
 
     def update_order(self, price, amount):
         """
         Update OrderBook by inserting a new price as key and amount as value to RBTree. If a price (key) already exists,
-        update its corresponding amount (value) to new amount.
+        update its corresponding amount (value) to new amount. The best levels are maintained in a small sorted cache,
+        so that best bid and ask are updated without searching the RBTree.
 
-        :param price: price of a limit order
-        :type price: float
-        :param amount: amount of the limit order
-        :type amount: float
-        :return: None
-        :rtype: NoneType
+        :param price: price of a limit order in ticks
+        :type price: int
+        :param amount: amount of the limit order in lots
+        :type amount: int
+        :return: True iff the best bid or best ask price changed
+        :rtype: bool
         """
+        top_changed = False
         # bid order
         if amount > 0:
+            if price >= self.bid_band_floor:
+                self._shift_bands(0, price, amount - self.bids.get(price, 0))
             # insert() method updates amount if price exists, add new Node with price and amount otherwise
             self.bids.insert(price, amount)
-            # update max and min
-            if price > self.bid_max:
-                self.bid_max = price
-            if price < self.bid_min:
+            if price >= self.bid_cache_bound:
+                prices = self.bid_cache_prices
+                _set_level(prices, self.bid_cache_sizes, price, amount)
+                # drop the worst cached level once the cache is full, it becomes the new bound
+                if len(prices) > self.cache_depth:
+                    del prices[0]
+                    del self.bid_cache_sizes[0]
+                    self.bid_cache_bound = prices[0]
+                top_changed = prices[-1] != self.bid_max
+                self.bid_max = prices[-1]
+            if len(self.bids) == 1 or price < self.bid_min:
                 self.bid_min = price
         # ask order
         elif amount < 0:
+            if price <= self.ask_band_ceiling:
+                self._shift_bands(1, price, -amount - self.asks.get(price, 0))
             self.asks.insert(price, -amount)
-            if price > self.ask_max:
+            if price <= self.ask_cache_bound:
+                prices = self.ask_cache_prices
+                _set_level(prices, self.ask_cache_sizes, price, -amount)
+                if len(prices) > self.cache_depth:
+                    del prices[-1]
+                    del self.ask_cache_sizes[-1]
+                    self.ask_cache_bound = prices[-1]
+                top_changed = prices[0] != self.ask_min
+                self.ask_min = prices[0]
+            if len(self.asks) == 1 or price > self.ask_max:
                 self.ask_max = price
-            if price < self.ask_min:
-                self.ask_min = price
         # amount is 0, all liquidity at price level consumed
         else:
             # remove the order from bids
-            if price in self.bids:
-                self.bids.pop(price)
-                # update max and min by searching RBTree, time complexity O(log(n))
-                if price == self.bid_max:
-                    self.bid_max = self.bids.max_key()
-                elif price == self.bid_min:
-                    self.bid_min = self.bids.min_key()
+            size = self.bids.pop(price, None)
+            if size is not None:
+                if price >= self.bid_band_floor:
+                    self._shift_bands(0, price, -size)
+                top_changed = price == self.bid_max
+                if price >= self.bid_cache_bound:
+                    _remove_level(self.bid_cache_prices, self.bid_cache_sizes, price)
+                    if not self.bid_cache_prices:
+                        self._refill_bid_cache()
+                    self.bid_max = self.bid_cache_prices[-1] if self.bid_cache_prices else math.nan
+                # the worst level is only searched in RBTree when it is removed, time complexity O(log(n))
+                if price == self.bid_min:
+                    self.bid_min = self.bids.min_key() if self.bids else math.nan
             # remove the order from asks
-            if price in self.asks:
-                self.asks.pop(price)
+            size = self.asks.pop(price, None)
+            if size is not None:
+                if price <= self.ask_band_ceiling:
+                    self._shift_bands(1, price, -size)
+                top_changed = top_changed or price == self.ask_min
+                if price <= self.ask_cache_bound:
+                    _remove_level(self.ask_cache_prices, self.ask_cache_sizes, price)
+                    if not self.ask_cache_prices:
+                        self._refill_ask_cache()
+                    self.ask_min = self.ask_cache_prices[0] if self.ask_cache_prices else math.nan
                 if price == self.ask_max:
-                    self.ask_max = self.asks.max_key()
-                elif price == self.ask_min:
-                    self.ask_min = self.asks.min_key()
-
-
-# code for testing the functionality of OrderBook
-# if __name__ == "__main__":
-#     book_data = pd.read_csv("/Users/ramborghini/Desktop/midpoint/book.csv")
-#
-#     btc_usd_orderbook = OrderBook()
-#
-#     for pair, price, amount in zip(book_data["pair"], book_data["price"], book_data["amount"]):
-#         if pair == "BTC-USD":
-#              btc_usd_orderbook.update_order(price, amount)
-#
-#     print(btc_usd_orderbook)
-#     print(btc_usd_orderbook.get_midpoint())
-#     print(btc_usd_orderbook.get_spread())
-#     print(btc_usd_orderbook.get_liquidity())
+                    self.ask_max = self.asks.max_key() if self.asks else math.nan
+        if top_changed and self.liquidity_bands:
+            self._clear_bands()
+        return top_changed
+
+    def _refill_bid_cache(self):
+        """
+        Reload the best bid levels from RBTree into the empty bid cache.
+
+        :return: None
+        :rtype: NoneType
+        """
+        levels = self.bids.nlargest(self.cache_depth)[::-1]
+        self.bid_cache_prices = [price for price, _ in levels]
+        self.bid_cache_sizes = [size for _, size in levels]
+        self.bid_cache_bound = self.bid_cache_prices[0] if levels else -math.inf
+
+    def _refill_ask_cache(self):
+        """
+        Reload the best ask levels from RBTree into the empty ask cache.
+
+        :return: None
+        :rtype: NoneType
+        """
+        levels = self.asks.nsmallest(self.cache_depth)
+        self.ask_cache_prices = [price for price, _ in levels]
+        self.ask_cache_sizes = [size for _, size in levels]
+        self.ask_cache_bound = self.ask_cache_prices[-1] if levels else math.inf
+
+
+class ArrayOrderBook(BaseOrderBook):
+    def __init__(self):
+        """
+        Instantiate ArrayOrderBook object which keeps each side as contiguous price and size buffers sorted by price
+        """
+        super().__init__()
+        # price levels in ascending order on both sides, sizes are stored at the same index as their price
+        self.bid_prices = array("q")
+        self.bid_sizes = array("q")
+        self.ask_prices = array("q")
+        self.ask_sizes = array("q")
+
+    def __eq__(self, other):
+        """
+        Return True iff self and other have exactly the same price levels and sizes on both sides
+
+        :param other: Any object used for comparison
+        :type other: Any
+        :return: whether self and other are the same
+        :rtype: bool
+        """
+        if not type(self) == type(other):
+            return False
+        return (
+            self.bid_prices == other.bid_prices
+            and self.bid_sizes == other.bid_sizes
+            and self.ask_prices == other.ask_prices
+            and self.ask_sizes == other.ask_sizes
+        )
+
+    def _sum_band(self, lower_bound_bid, upper_bound_ask):
+        """
+        Sum the sizes of the bids at or above lower_bound_bid and of the asks at or below upper_bound_ask. Both bands
+        are contiguous slices of the size buffers.
+
+        :param lower_bound_bid: lowest bid price in the band
+        :type lower_bound_bid: float
+        :param upper_bound_ask: highest ask price in the band
+        :type upper_bound_ask: float
+        :return: bid and ask liquidity
+        :rtype: float, float
+        """
+        bid_liquidity = sum(self.bid_sizes[bisect_left(self.bid_prices, lower_bound_bid) :])
+        ask_liquidity = sum(self.ask_sizes[: bisect_right(self.ask_prices, upper_bound_ask)])
+        return bid_liquidity, ask_liquidity
+
+    def _get_side(self, side):
+        """
+        Copy the price levels of one side into arrays.
+
+        :param side: "bid" or "ask"
+        :type side: str
+        :return: prices in ascending order and their sizes
+        :rtype: numpy.ndarray, numpy.ndarray
+        """
+        if side == "bid":
+            return np.array(self.bid_prices), np.array(self.bid_sizes)
+        return np.array(self.ask_prices), np.array(self.ask_sizes)
+
+    def iter_levels(self, side):
+        """
+        Iterate over the price levels of one side from the best price outward, without copying the side. The book must
+        not change during the iteration.
+
+        :param side: "bid" or "ask"
+        :type side: str
+        :return: price and size of each level
+        :rtype: Iterator[tuple]
+        """
+        if side == "bid":
+            return zip(reversed(self.bid_prices), reversed(self.bid_sizes))
+        return zip(self.ask_prices, self.ask_sizes)
+
+    def get_top_levels(self, n):
+        """
+        Get the best n price levels of each side.
+
+        :param n: number of price levels per side
+        :type n: int
+        :return: (price, size) of the best bids in descending and of the best asks in ascending order of price
+        :rtype: list, list
+        """
+        first_bid = max(len(self.bid_prices) - n, 0)
+        top_bids = list(zip(self.bid_prices[first_bid:][::-1], self.bid_sizes[first_bid:][::-1]))
+        top_asks = list(zip(self.ask_prices[:n], self.ask_sizes[:n]))
+        return top_bids, top_asks
+
+    def update_order(self, price, amount):
+        """
+        Update ArrayOrderBook by inserting a new price level with bisect, or overwriting the size of an existing level.
+        A zero amount removes the price level from both sides.
+
+        :param price: price of a limit order in ticks
+        :type price: int
+        :param amount: amount of the limit order in lots
+        :type amount: int
+        :return: True iff the best bid or best ask price changed
+        :rtype: bool
+        """
+        top_changed = False
+        # bid order
+        if amount > 0:
+            change = amount - _set_level(self.bid_prices, self.bid_sizes, price, amount)
+            if price >= self.bid_band_floor:
+                self._shift_bands(0, price, change)
+            top_changed = self.bid_prices[-1] != self.bid_max
+            self.bid_max = self.bid_prices[-1]
+            self.bid_min = self.bid_prices[0]
+        # ask order
+        elif amount < 0:
+            change = -amount - _set_level(self.ask_prices, self.ask_sizes, price, -amount)
+            if price <= self.ask_band_ceiling:
+                self._shift_bands(1, price, change)
+            top_changed = self.ask_prices[0] != self.ask_min
+            self.ask_max = self.ask_prices[-1]
+            self.ask_min = self.ask_prices[0]
+        # amount is 0, all liquidity at price level consumed
+        else:
+            size = _remove_level(self.bid_prices, self.bid_sizes, price)
+            if size is not None:
+                if price >= self.bid_band_floor:
+                    self._shift_bands(0, price, -size)
+                top_changed = price == self.bid_max
+                self.bid_max = self.bid_prices[-1] if self.bid_prices else math.nan
+                self.bid_min = self.bid_prices[0] if self.bid_prices else math.nan
+            size = _remove_level(self.ask_prices, self.ask_sizes, price)
+            if size is not None:
+                if price <= self.ask_band_ceiling:
+                    self._shift_bands(1, price, -size)
+                top_changed = top_changed or price == self.ask_min
+                self.ask_max = self.ask_prices[-1] if self.ask_prices else math.nan
+                self.ask_min = self.ask_prices[0] if self.ask_prices else math.nan
+        if top_changed and self.liquidity_bands:
+            self._clear_bands()
+        return top_changed
+
+
+def _set_level(prices, sizes, price, size):
+    """
+    Set the size of a price level in sorted price and size buffers, inserting the level if it does not exist.
+
+    :param prices: price levels sorted in ascending order
+    :type prices: array.array or list
+    :param sizes: sizes of the price levels
+    :type sizes: array.array or list
+    :param price: price of the level
+    :type price: int
+    :param size: new size of the level
+    :type size: int
+    :return: previous size of the level, 0 if it did not exist
+    :rtype: int
+    """
+    i = bisect_left(prices, price)
+    if i < len(prices) and prices[i] == price:
+        old_size = sizes[i]
+        sizes[i] = size
+        return old_size
+    prices.insert(i, price)
+    sizes.insert(i, size)
+    return 0
+
+
+def _remove_level(prices, sizes, price):
+    """
+    Remove a price level from sorted price and size buffers.
+
+    :param prices: price levels sorted in ascending order
+    :type prices: array.array or list
+    :param sizes: sizes of the price levels
+    :type sizes: array.array or list
+    :param price: price of the level
+    :type price: int
+    :return: size of the removed level, None if the level did not exist
+    :rtype: int
+    """
+    i = bisect_left(prices, price)
+    if i < len(prices) and prices[i] == price:
+        size = sizes[i]
+        del prices[i]
+        del sizes[i]
+        return size
+    return None
+
+
+BOOK_BACKENDS = {"rbtree": OrderBook, "array": ArrayOrderBook}
+
+
+def create_order_book(backend="rbtree"):
+    """
+    Create an empty order book with the requested backend.
+
+    :param backend: name of the backend, "rbtree" for OrderBook or "array" for ArrayOrderBook
+    :type backend: str
+    :return: an empty order book
+    :rtype: BaseOrderBook
+    """
+    try:
+        return BOOK_BACKENDS[backend]()
+    except KeyError:
+        raise ValueError("Unknown order book backend {}, expected one of {}.".format(backend, list(BOOK_BACKENDS)))
+
+
+def check_backend_parity(updates, backends=("rbtree", "array")):
+    """
+    Replay the same updates through every backend and check that the books agree after each update.
+
+    :param updates: sequence of (price, amount) updates
+    :type updates: list
+    :param backends: names of the backends to compare
+    :type backends: tuple
+    :return: None
+    :rtype: NoneType
+    """
+    books = [create_order_book(backend) for backend in backends]
+    reference = books[0]
+    for n, (price, amount) in enumerate(updates):
+        top_changed = [book.update_order(price, amount) for book in books]
+        expected = _book_state(reference)
+        for backend, book, book_top_changed in zip(backends[1:], books[1:], top_changed[1:]):
+            assert book_top_changed == top_changed[0], (backend, n)
+            # compare on string representation so that NaN of empty sides matches
+            assert str(_book_state(book)) == str(expected), (backend, n)
+        for backend, book in zip(backends, books):
+            # memoized liquidity bands match a fresh sum exactly, sizes are integer lots
+            for lower_bound_bid, upper_bound_ask, *liquidity in book.liquidity_bands.values():
+                assert tuple(liquidity) == book._sum_band(lower_bound_bid, upper_bound_ask), (backend, n)
+
+
+def _book_state(book):
+    """
+    Collect the observable state of an order book for comparing backends.
+
+    :param book: order book of any backend
+    :type book: BaseOrderBook
+    :return: extremes of both sides, spread, midpoint, liquidity of two bands, best levels, and the levels iterated
+        from the best price outward
+    :rtype: tuple
+    """
+    return (
+        book.bid_max,
+        book.bid_min,
+        book.ask_max,
+        book.ask_min,
+        book.get_spread(),
+        book.get_midpoint(),
+        book.get_liquidity(),
+        book.get_liquidity(0.5),
+        book.get_top_levels(8),
+        list(islice(book.iter_levels("bid"), 20)),
+        list(islice(book.iter_levels("ask"), 20)),
+    )
+
+
+# replay random updates through both backends and check that they match
+if __name__ == "__main__":
+    rng = random.Random(0)
+    # prices in ticks of 0.01 between 9990 and 10010, sizes in lots of 0.00000001 between 0.01 and 5
+    parity_updates = []
+    for _ in range(10000):
+        level_price = rng.randint(999000, 1001000)
+        if rng.random() < 0.45:
+            parity_updates.append((level_price, 0))
+        else:
+            side = 1 if level_price < 1000000 else -1
+            parity_updates.append((level_price, side * rng.randint(1000000, 500000000)))
+    # remove every level at the end, so that both sides run empty
+    parity_updates += [(price, 0) for price, _ in parity_updates]
+    check_backend_parity(parity_updates)
+    print("Backends {} agree on {} updates.".format(list(BOOK_BACKENDS), len(parity_updates)))
@@ -0,0 +1,400 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+import metrics
+from compute_market_data import (
+    AGG_COLUMNS,
+    BAR_WIDTH,
+    SESSION_LENGTH,
+    VOL_COLUMNS,
+    compute_market_data_parallel,
+    compute_vols,
+)
+from data_io import EPOCH_OFFSET, PAIRS, build_cache, load_cache_meta
+from order_book import BOOK_BACKENDS, LIQUIDITY_MULTIPLIER
+from price_encoding import get_encoding
+from volatility_analysis import PLOT_PAIRS, VOL_FIGURES, render_figures
+
+logger = logging.getLogger(__name__)
+
+# part of every key, a manual override to invalidate all results, e.g. after an upgrade of numpy or pandas
+PIPELINE_VERSION = 1
+
+# source files of the code computing each stage, their digests are part of the keys of the stage
+STAGE_SOURCES = {
+    "input_cache": ["data_io.py"],
+    "bars": ["compute_market_data.py", "order_book.py", "price_encoding.py", "data_io.py"],
+    "volatility": ["compute_market_data.py"],
+    "figure": ["volatility_analysis.py"],
+}
+
+# columns of a pair in the binary caches its market data is computed from, seq also changes with the other pairs
+INPUT_COLUMNS = ["price", "amount", "servert"]
+
+# number of bytes read at a time when hashing a file
+HASH_BLOCK_SIZE = 1 << 20
+
+
+class PipelineCache:
+    def __init__(self, cache_dir):
+        """
+        Instantiate PipelineCache object which stores the results of pipeline stages under keys hashed from the
+        content of their inputs, their parameters, and the source code of the stage, and remembers the key each output
+        file was written with. A stage is recomputed only if no result is stored under its key, and an output is
+        rewritten only if its key changed. The digest of an input or source file is kept with its size and modification
+        time, so an unchanged file is not hashed again.
+
+        :param cache_dir: directory of the results, the keys of the outputs, and the digests of input and source files
+        :type cache_dir: str
+        """
+        self.cache_dir = cache_dir
+        os.makedirs(os.path.join(cache_dir, "objects"), exist_ok=True)
+        # key each output file was written with, keyed by its absolute path
+        self.manifest = self._load_json("manifest.json")
+        # size, modification time in nanoseconds, and sha256 of each input and source file, keyed by its absolute path
+        self.file_digests = self._load_json("file_digests.json")
+
+    def file_digest(self, path):
+        """
+        Hash the content of a file, or look up its digest if its size and modification time did not change.
+
+        :param path: path of the file
+        :type path: str
+        :return: sha256 of the content as hex
+        :rtype: str
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        entry = self.file_digests.get(path)
+        if entry is not None and entry[:2] == [stat.st_size, stat.st_mtime_ns]:
+            return entry[2]
+        digest = hashlib.sha256()
+        with metrics.timer("input_hashing"):
+            with open(path, "rb") as input_file:
+                for block in iter(lambda: input_file.read(HASH_BLOCK_SIZE), b""):
+                    digest.update(block)
+        self.file_digests[path] = [stat.st_size, stat.st_mtime_ns, digest.hexdigest()]
+        return digest.hexdigest()
+
+    def get_key(self, stage, inputs):
+        """
+        Hash the name of a stage with the digests and parameters it is computed from, and with the digests of its
+        source files in STAGE_SOURCES.
+
+        :param stage: name of the stage
+        :type stage: str
+        :param inputs: digests of input files, keys of earlier stages, and parameters, json serializable
+        :type inputs: dict
+        :return: key of the result as hex
+        :rtype: str
+        """
+        source_dir = os.path.dirname(os.path.abspath(__file__))
+        code = {name: self.file_digest(os.path.join(source_dir, name)) for name in STAGE_SOURCES.get(stage, [])}
+        payload = json.dumps(
+            {"stage": stage, "version": PIPELINE_VERSION, "code": code, "inputs": inputs}, sort_keys=True
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def load_frame(self, key):
+        """
+        Load the dataframe stored under a key.
+
+        :param key: key of the result
+        :type key: str
+        :return: the stored dataframe, None if nothing is stored under the key
+        :rtype: pandas.DataFrame
+        """
+        path = self._object_path(key)
+        if not os.path.exists(path):
+            metrics.count("cache_misses")
+            return None
+        metrics.count("cache_hits")
+        with np.load(path) as stored:
+            columns = stored["columns"].tolist()
+            return pd.DataFrame({column: stored[str(index)] for index, column in enumerate(columns)}, columns=columns)
+
+    def store_frame(self, key, frame):
+        """
+        Store a dataframe of numeric columns under a key. The file is written under a temporary name and renamed, so
+        an interrupted run leaves no partial result behind.
+
+        :param key: key of the result
+        :type key: str
+        :param frame: result of a stage
+        :type frame: pandas.DataFrame
+        :return: None
+        :rtype: NoneType
+        """
+        path = self._object_path(key)
+        arrays = {str(index): frame[column].to_numpy(dtype=float) for index, column in enumerate(frame.columns)}
+        with open(path + ".tmp", "wb") as object_file:
+            np.savez(object_file, columns=np.array(list(frame.columns)), **arrays)
+        os.replace(path + ".tmp", path)
+
+    def is_current(self, path, key):
+        """
+        Check whether an output file exists and was written with a key.
+
+        :param path: path of the output file
+        :type path: str
+        :param key: key of the result the file is written from
+        :type key: str
+        :return: True iff the file needs no rewrite
+        :rtype: bool
+        """
+        return os.path.exists(path) and self.manifest.get(os.path.abspath(path)) == key
+
+    def mark_current(self, path, key):
+        """
+        Record the key an output file was written with.
+
+        :param path: path of the output file
+        :type path: str
+        :param key: key of the result the file was written from
+        :type key: str
+        :return: None
+        :rtype: NoneType
+        """
+        self.manifest[os.path.abspath(path)] = key
+
+    def save(self):
+        """
+        Write the keys of the outputs and the digests of input and source files to the cache directory.
+
+        :return: None
+        :rtype: NoneType
+        """
+        for name, values in [("manifest.json", self.manifest), ("file_digests.json", self.file_digests)]:
+            path = os.path.join(self.cache_dir, name)
+            with open(path + ".tmp", "w") as json_file:
+                json.dump(values, json_file, indent=1, sort_keys=True)
+            os.replace(path + ".tmp", path)
+
+    def _load_json(self, name):
+        """
+        Load a json file of the cache directory.
+
+        :param name: file name
+        :type name: str
+        :return: the content of the file, empty if it does not exist yet
+        :rtype: dict
+        """
+        path = os.path.join(self.cache_dir, name)
+        if not os.path.exists(path):
+            return {}
+        with open(path) as json_file:
+            return json.load(json_file)
+
+    def _object_path(self, key):
+        """
+        Return the path of the file a result is stored in.
+
+        :param key: key of the result
+        :type key: str
+        :return: path of the .npz file
+        :rtype: str
+        """
+        return os.path.join(self.cache_dir, "objects", key + ".npz")
+
+
+def build_input_cache(cache, source, cache_dir, pairs=PAIRS):
+    """
+    Build the binary cache of a csv file with data_io.build_cache, unless it was already built from the same content.
+
+    :param cache: cache of the pipeline
+    :type cache: PipelineCache
+    :param source: path of book.csv or trades.csv, or of a binary cache directory which is used as is
+    :type source: str
+    :param cache_dir: directory the binary cache is written to
+    :type cache_dir: str
+    :param pairs: pair names of two currencies to keep
+    :type pairs: list
+    :return: directory of the binary cache
+    :rtype: str
+    """
+    if os.path.isdir(source):
+        return source
+    key = cache.get_key("input_cache", {"csv": cache.file_digest(source), "pairs": list(pairs)})
+    meta_path = os.path.join(cache_dir, "meta.json")
+    if not cache.is_current(meta_path, key):
+        logger.info("Building binary cache of %s.", source)
+        with metrics.timer("build_cache"):
+            build_cache(source, cache_dir, pairs)
+        cache.mark_current(meta_path, key)
+    return cache_dir
+
+
+def get_pair_digest(cache, input_cache, pair):
+    """
+    Hash the partition of a pair in a binary cache, so that a change of the data of one pair only invalidates the
+    results of that pair.
+
+    :param cache: cache of the pipeline
+    :type cache: PipelineCache
+    :param input_cache: directory of the binary cache of book or trade data
+    :type input_cache: str
+    :param pair: pair name of two currencies
+    :type pair: str
+    :return: epoch offset of the binary cache and digest of each column of the pair
+    :rtype: dict
+    """
+    # column files of the pair in the layout of data_io.build_cache
+    columns = {column: cache.file_digest(os.path.join(input_cache, pair, column + ".npy")) for column in INPUT_COLUMNS}
+    return {"epoch_offset": load_cache_meta(input_cache)["epoch_offset"], "columns": columns}
+
+
+def run_pipeline(
+    book_path,
+    trade_path,
+    output_dir="./data_output",
+    figure_dir="./figure_output",
+    cache_dir="./cache",
+    pairs=PAIRS,
+    epoch_offset=EPOCH_OFFSET,
+    backend="rbtree",
+    vol_columns=VOL_COLUMNS,
+    figures=VOL_FIGURES,
+    max_workers=None,
+):
+    """
+    Compute the aggregated market information of each pair and the volatility figures, recomputing only the stages
+    whose inputs or parameters changed since an earlier run:
+
+    1. binary caches of book.csv and trades.csv, rebuilt when the content of the csv file changed
+    2. trade bars and order book samples of each pair, recomputed in worker processes for the pairs whose partitions
+       of the binary caches, tick and lot size, or bar parameters changed
+    3. volatility columns of each pair, recomputed when the bars or vol_columns changed, and the csv file of the pair
+       under output_dir, rewritten when either changed
+    4. figures, rendered headless in worker processes when the data they plot or their layout changed
+
+    :param book_path: csv file of book data, or binary cache directory built from it
+    :type book_path: str
+    :param trade_path: csv file of trade data, or binary cache directory built from it
+    :type trade_path: str
+    :param output_dir: directory the csv file of each pair is written to
+    :type output_dir: str
+    :param figure_dir: directory the png figures are saved to
+    :type figure_dir: str
+    :param cache_dir: directory of the binary caches built from csv files and of the pipeline cache
+    :type cache_dir: str
+    :param pairs: pair names of two currencies, figures are rendered if the pairs include PLOT_PAIRS
+    :type pairs: list
+    :param epoch_offset: start of the session in microseconds since epoch
+    :type epoch_offset: int
+    :param backend: name of the order book backend, see order_book.BOOK_BACKENDS
+    :type backend: str
+    :param vol_columns: (price type, return interval, number of periods) keyed by the name of the volatility column
+    :type vol_columns: dict
+    :param figures: midpoint and last price volatility columns and label keyed by figure name, see VOL_FIGURES
+    :type figures: dict
+    :param max_workers: number of worker processes, None for the number of cpus, 1 to run in this process
+    :type max_workers: int
+    :return: dataframes of minute level aggregated market information keyed by pair
+    :rtype: dict
+    """
+    cache = PipelineCache(os.path.join(cache_dir, "pipeline"))
+    os.makedirs(output_dir, exist_ok=True)
+    try:
+        book_cache = build_input_cache(cache, book_path, os.path.join(cache_dir, "book"))
+        trade_cache = build_input_cache(cache, trade_path, os.path.join(cache_dir, "trades"))
+
+        # the backend is not part of the key, the backends produce the same books, see order_book.py
+        bar_keys = {}
+        for pair in pairs:
+            encoding = get_encoding(pair)
+            bar_inputs = {
+                "pair": pair,
+                "book": get_pair_digest(cache, book_cache, pair),
+                "trades": get_pair_digest(cache, trade_cache, pair),
+                "epoch_offset": epoch_offset,
+                "bar_width": BAR_WIDTH,
+                "session_length": SESSION_LENGTH,
+                "agg_columns": AGG_COLUMNS,
+                "tick_size": encoding.tick_size,
+                "lot_size": encoding.lot_size,
+                "liquidity_multiplier": LIQUIDITY_MULTIPLIER,
+            }
+            bar_keys[pair] = cache.get_key("bars", bar_inputs)
+        bars = {pair: cache.load_frame(key) for pair, key in bar_keys.items()}
+        stale_pairs = [pair for pair in pairs if bars[pair] is None]
+        if stale_pairs:
+            logger.info("Computing market data of %s.", ", ".join(stale_pairs))
+            computed = compute_market_data_parallel(
+                book_cache, trade_cache, stale_pairs, [epoch_offset], max_workers, backend, vol_columns={}
+            )
+            for pair, agg_data in computed.items():
+                cache.store_frame(bar_keys[pair], agg_data)
+                bars[pair] = agg_data
+
+        market_data = {}
+        output_keys = {}
+        for pair in pairs:
+            output_keys[pair] = cache.get_key("volatility", {"bars": bar_keys[pair], "vol_columns": vol_columns})
+            vols = cache.load_frame(output_keys[pair])
+            if vols is None:
+                with metrics.timer("volatility"):
+                    vols = compute_vols(bars[pair], vol_columns)
+                cache.store_frame(output_keys[pair], vols)
+            agg_data = bars[pair].copy()
+            for column in vol_columns:
+                agg_data[column] = vols[column].to_numpy()
+            market_data[pair] = agg_data
+            output_path = os.path.join(output_dir, pair + ".csv")
+            if not cache.is_current(output_path, output_keys[pair]):
+                with metrics.timer("csv_write"):
+                    agg_data.to_csv(output_path, index=False)
+                cache.mark_current(output_path, output_keys[pair])
+
+        if not set(PLOT_PAIRS).issubset(pairs):
+            logger.info("Figures are not rendered, they plot %s.", ", ".join(PLOT_PAIRS))
+            return market_data
+        figure_paths = {}
+        stale_figures = {}
+        for name, figure in figures.items():
+            figure_inputs = {"data": [output_keys[pair] for pair in PLOT_PAIRS], "pairs": PLOT_PAIRS, "figure": figure}
+            figure_paths[name] = (os.path.join(figure_dir, name + ".png"), cache.get_key("figure", figure_inputs))
+            if not cache.is_current(*figure_paths[name]):
+                stale_figures[name] = figure
+        if stale_figures:
+            logger.info("Rendering figures %s.", ", ".join(stale_figures))
+            with metrics.timer("figures"):
+                render_figures(market_data, figure_dir, stale_figures, PLOT_PAIRS, max_workers)
+            for name in stale_figures:
+                cache.mark_current(*figure_paths[name])
+        return market_data
+    finally:
+        cache.save()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compute the market data of each pair and the volatility figures, recomputing only what changed."
+    )
+    parser.add_argument("book_path", help="csv file of book data, or binary cache directory built from it")
+    parser.add_argument("trade_path", help="csv file of trade data, or binary cache directory built from it")
+    parser.add_argument("--output-dir", default="./data_output", help="directory the csv file of each pair goes to")
+    parser.add_argument("--figure-dir", default="./figure_output", help="directory the png figures are saved to")
+    parser.add_argument("--cache-dir", default="./cache", help="directory of the binary caches and pipeline cache")
+    parser.add_argument("--pairs", nargs="+", default=PAIRS, help="pair names of two currencies")
+    parser.add_argument("--backend", choices=list(BOOK_BACKENDS), default="rbtree", help="order book backend")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes computing pairs and figures")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    run_metrics = metrics.enable()
+    run_pipeline(
+        args.book_path,
+        args.trade_path,
+        args.output_dir,
+        args.figure_dir,
+        args.cache_dir,
+        args.pairs,
+        backend=args.backend,
+        max_workers=args.workers,
+    )
+    run_metrics.export(os.path.join(args.output_dir, "metrics_pipeline.json"))
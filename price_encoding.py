@@ -0,0 +1,183 @@
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# distance from the grid, in ticks or lots, up to which a value is on it, plus the relative error of floats it allows
+GRID_TOLERANCE = 1e-6
+GRID_RELATIVE_TOLERANCE = 4e-15
+
+
+class PairEncoding:
+    def __init__(self, tick_size, lot_size):
+        """
+        Instantiate PairEncoding object which converts the decimal prices and sizes of a pair to integer ticks and
+        lots, and back. Order books hold ticks and lots, so that price levels match exactly and sizes add up without
+        rounding, decimals only come back when results leave the books. Prices and sizes off the grid are rounded to
+        the nearest tick and lot, with a warning logged once per call.
+
+        :param tick_size: smallest price increment, 1 over an integer such as 0.01
+        :type tick_size: float
+        :param lot_size: smallest size increment, 1 over an integer such as 0.00000001
+        :type lot_size: float
+        """
+        self.tick_size = tick_size
+        self.lot_size = lot_size
+        # decoding divides by these integers, which gives back the closest float to the decimal, as parsing does
+        self.ticks_per_unit = round(1 / tick_size)
+        self.lots_per_unit = round(1 / lot_size)
+        if abs(self.ticks_per_unit * tick_size - 1) > 1e-9 or abs(self.lots_per_unit * lot_size - 1) > 1e-9:
+            raise ValueError("Tick size {} and lot size {} must be 1 over an integer.".format(tick_size, lot_size))
+
+    def encode_prices(self, prices):
+        """
+        Convert decimal prices to ticks.
+
+        :param prices: decimal prices
+        :type prices: numpy.ndarray
+        :return: prices in ticks
+        :rtype: numpy.ndarray
+        """
+        return _snap_to_grid(np.asarray(prices, dtype=float) * self.ticks_per_unit, "tick")
+
+    def encode_sizes(self, sizes):
+        """
+        Convert decimal sizes or signed amounts to lots.
+
+        :param sizes: decimal sizes
+        :type sizes: numpy.ndarray
+        :return: sizes in lots
+        :rtype: numpy.ndarray
+        """
+        return _snap_to_grid(np.asarray(sizes, dtype=float) * self.lots_per_unit, "lot")
+
+    def encode_price(self, price):
+        """
+        Convert one decimal price to ticks.
+
+        :param price: decimal price
+        :type price: float
+        :return: price in ticks
+        :rtype: int
+        """
+        ticks = price * self.ticks_per_unit
+        encoded = round(ticks)
+        if abs(ticks - encoded) > GRID_TOLERANCE + GRID_RELATIVE_TOLERANCE * abs(ticks):
+            logger.warning("Price %r is off the tick grid and rounded to %d ticks.", price, encoded)
+        return encoded
+
+    def encode_size(self, size):
+        """
+        Convert one decimal size or signed amount to lots.
+
+        :param size: decimal size
+        :type size: float
+        :return: size in lots
+        :rtype: int
+        """
+        lots = size * self.lots_per_unit
+        encoded = round(lots)
+        if abs(lots - encoded) > GRID_TOLERANCE + GRID_RELATIVE_TOLERANCE * abs(lots):
+            logger.warning("Size %r is off the lot grid and rounded to %d lots.", size, encoded)
+        return encoded
+
+    def decode_prices(self, ticks):
+        """
+        Convert prices in ticks, or a spread or midpoint in ticks, to decimals.
+
+        :param ticks: prices in ticks, a scalar or an array
+        :type ticks: int or numpy.ndarray
+        :return: decimal prices
+        :rtype: float or numpy.ndarray
+        """
+        return ticks / self.ticks_per_unit
+
+    def decode_sizes(self, lots):
+        """
+        Convert sizes in lots to decimals.
+
+        :param lots: sizes in lots, a scalar or an array
+        :type lots: int or numpy.ndarray
+        :return: decimal sizes
+        :rtype: float or numpy.ndarray
+        """
+        return lots / self.lots_per_unit
+
+
+# tick and lot size of each pair on the exchange
+PAIR_ENCODINGS = {
+    "BTC-USD": PairEncoding(0.01, 0.00000001),
+    "BTC-EUR": PairEncoding(0.01, 0.00000001),
+    "BCH-USD": PairEncoding(0.01, 0.00000001),
+    "BCH-EUR": PairEncoding(0.01, 0.00000001),
+    "BCH-BTC": PairEncoding(0.00001, 0.00000001),
+}
+
+# encoding of pairs without an entry in PAIR_ENCODINGS, exact for up to 8 decimals and prices up to 9e10
+DEFAULT_ENCODING = PairEncoding(0.00000001, 0.00000001)
+
+
+def get_encoding(pair):
+    """
+    Look up the encoding of a pair.
+
+    :param pair: pair name of two currencies
+    :type pair: str
+    :return: the encoding of the pair, DEFAULT_ENCODING if the pair has no entry in PAIR_ENCODINGS
+    :rtype: PairEncoding
+    """
+    return PAIR_ENCODINGS.get(pair, DEFAULT_ENCODING)
+
+
+def encode_rows(prices, amounts, codes, encodings):
+    """
+    Encode the prices and amounts of rows of several pairs, each row with the encoding its pair code points to.
+
+    :param prices: decimal prices
+    :type prices: numpy.ndarray
+    :param amounts: decimal amounts
+    :type amounts: numpy.ndarray
+    :param codes: pair code of each row, an index into encodings, -1 for DEFAULT_ENCODING
+    :type codes: numpy.ndarray
+    :param encodings: encoding of each pair code
+    :type encodings: list
+    :return: prices in ticks and amounts in lots
+    :rtype: numpy.ndarray, numpy.ndarray
+    """
+    # code -1 picks the default encoding appended at the end
+    encodings = list(encodings) + [DEFAULT_ENCODING]
+    ticks_per_unit = np.array([encoding.ticks_per_unit for encoding in encodings], dtype=float)[codes]
+    lots_per_unit = np.array([encoding.lots_per_unit for encoding in encodings], dtype=float)[codes]
+    price_ticks = _snap_to_grid(np.asarray(prices, dtype=float) * ticks_per_unit, "tick")
+    amount_lots = _snap_to_grid(np.asarray(amounts, dtype=float) * lots_per_unit, "lot")
+    return price_ticks, amount_lots
+
+
+def _snap_to_grid(values, unit):
+    """
+    Round prices or sizes scaled to ticks or lots to the nearest integer, and log a warning if any of them is off the
+    grid by more than float error.
+
+    :param values: prices in ticks or sizes in lots as floats
+    :type values: numpy.ndarray
+    :param unit: "tick" or "lot", named in the warning
+    :type unit: str
+    :return: values rounded to integers
+    :rtype: numpy.ndarray
+    """
+    rounded = np.rint(values)
+    off_grid = np.abs(values - rounded) > GRID_TOLERANCE + GRID_RELATIVE_TOLERANCE * np.abs(values)
+    num_off_grid = int(np.count_nonzero(off_grid))
+    if num_off_grid > 0:
+        logger.warning(
+            "%d of %d values are off the %s grid and rounded to the nearest %s, e.g. %r %ss.",
+            num_off_grid,
+            off_grid.size,
+            unit,
+            unit,
+            float(values[off_grid].flat[0]),
+            unit,
+        )
+    return rounded.astype(np.int64)
+
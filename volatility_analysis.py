@@ -1,64 +1,109 @@
-import pandas as pd
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib
 import matplotlib.pyplot as plt
+import pandas as pd
 
-btc_usd = pd.read_csv("/Users/ramborghini/Documents/GitHub/CryptocurrencyTrading/data_output/BTC-USD.csv")
-btc_eur = pd.read_csv("/Users/ramborghini/Documents/GitHub/CryptocurrencyTrading/data_output/BTC-EUR.csv")
-bch_usd = pd.read_csv("/Users/ramborghini/Documents/GitHub/CryptocurrencyTrading/data_output/BCH-USD.csv")
-bch_eur = pd.read_csv("/Users/ramborghini/Documents/GitHub/CryptocurrencyTrading/data_output/BCH-EUR.csv")
-bch_btc = pd.read_csv("/Users/ramborghini/Documents/GitHub/CryptocurrencyTrading/data_output/BCH-BTC.csv")
+# pairs plotted in the 2 by 2 grid of each figure, row by row
+PLOT_PAIRS = ["BTC-USD", "BTC-EUR", "BCH-EUR", "BCH-BTC"]
 
-# plot 1 min volatility
-plt.figure()
-fig, axs = plt.subplots(2, 2, constrained_layout=True)
-fig.set_size_inches(9.5, 6.5)
+# midpoint and last price volatility columns and the label of their return interval, keyed by the figure file name
+VOL_FIGURES = {
+    "1min_vol": ("volatility_mid_1min", "volatility_last_1min", "1 min"),
+    "3min_vol": ("volatility_mid_3min", "volatility_last_3min", "3 min"),
+}
 
-axs[0, 0].plot(btc_usd["time_period"], btc_usd["volatility_mid_1min"], label = "mid_vol")
-axs[0, 0].plot(btc_usd["time_period"], btc_usd["volatility_last_1min"], label = "last_vol")
-axs[0, 0].legend()
-axs[0, 0].set(ylabel='BTC-USD 1 min Volatility')
 
-axs[0, 1].plot(btc_eur["time_period"], btc_eur["volatility_mid_1min"], label = "mid_vol")
-axs[0, 1].plot(btc_eur["time_period"], btc_eur["volatility_last_1min"], label = "last_vol")
-axs[0, 1].legend()
-axs[0, 1].set(ylabel='BTC-EUR 1 min Volatility')
+def load_market_data(data_dir, pairs=PLOT_PAIRS):
+    """
+    Load the aggregated market information of pairs written by compute_market_data.py.
 
-axs[1, 0].plot(bch_eur["time_period"], bch_eur["volatility_mid_1min"], label = "mid_vol")
-axs[1, 0].plot(bch_eur["time_period"], bch_eur["volatility_last_1min"], label = "last_vol")
-axs[1, 0].legend()
-axs[1, 0].set(xlabel='period', ylabel='BCH-EUR 1 min Volatility')
+    :param data_dir: directory holding one csv file per pair
+    :type data_dir: str
+    :param pairs: pair names of two currencies
+    :type pairs: list
+    :return: dataframes of minute level aggregated market information keyed by pair
+    :rtype: dict
+    """
+    return {pair: pd.read_csv(os.path.join(data_dir, pair + ".csv")) for pair in pairs}
 
-axs[1, 1].plot(bch_btc["time_period"], bch_btc["volatility_mid_1min"], label = "mid_vol")
-axs[1, 1].plot(bch_btc["time_period"], bch_btc["volatility_last_1min"], label = "last_vol")
-axs[1, 1].legend()
-axs[1, 1].set(xlabel='period', ylabel='BCH-BTC 1 min Volatility')
 
-plt.savefig('./figure_output/1min_vol.png', dpi=fig.dpi)
-plt.show()
+def plot_volatility(market_data, mid_column, last_column, label, path, pairs=PLOT_PAIRS):
+    """
+    Plot the midpoint and last price volatility of four pairs over the periods in a 2 by 2 grid and save it.
 
-# plot 3 min volatility
-plt.figure()
-fig, axs = plt.subplots(2, 2, constrained_layout=True)
-fig.set_size_inches(9.5, 6.5)
+    :param market_data: minute level aggregated market information keyed by pair, with time_period, mid_column, and
+        last_column
+    :type market_data: dict
+    :param mid_column: name of the midpoint volatility column
+    :type mid_column: str
+    :param last_column: name of the last price volatility column
+    :type last_column: str
+    :param label: return interval shown in the axis labels, e.g. "1 min"
+    :type label: str
+    :param path: png file the figure is saved to
+    :type path: str
+    :param pairs: four pair names of two currencies, row by row
+    :type pairs: list
+    :return: path of the saved figure
+    :rtype: str
+    """
+    fig, axs = plt.subplots(2, 2, constrained_layout=True)
+    fig.set_size_inches(9.5, 6.5)
+    for ax, pair in zip(axs.flat, pairs):
+        agg_data = market_data[pair]
+        ax.plot(agg_data["time_period"], agg_data[mid_column], label="mid_vol")
+        ax.plot(agg_data["time_period"], agg_data[last_column], label="last_vol")
+        ax.legend()
+        ax.set(ylabel="{} {} Volatility".format(pair, label))
+    for ax in axs[1]:
+        ax.set(xlabel="period")
+    fig.savefig(path, dpi=fig.dpi)
+    plt.close(fig)
+    return path
 
-axs[0, 0].plot(btc_usd["time_period"], btc_usd["volatility_mid_3min"], label = "mid_vol")
-axs[0, 0].plot(btc_usd["time_period"], btc_usd["volatility_last_3min"], label = "last_vol")
-axs[0, 0].legend()
-axs[0, 0].set(ylabel='BTC-USD 3 min Volatility')
 
-axs[0, 1].plot(btc_eur["time_period"], btc_eur["volatility_mid_3min"], label = "mid_vol")
-axs[0, 1].plot(btc_eur["time_period"], btc_eur["volatility_last_3min"], label = "last_vol")
-axs[0, 1].legend()
-axs[0, 1].set(ylabel='BTC-EUR 3 min Volatility')
+def render_figures(market_data, figure_dir, figures=VOL_FIGURES, pairs=PLOT_PAIRS, max_workers=None):
+    """
+    Render volatility figures in a pool of worker processes, one figure per worker. Only the plotted columns are
+    passed to the workers. Figures are rendered to files with the Agg backend, which is selected here and in every
+    worker, so that no display is needed.
 
-axs[1, 0].plot(bch_eur["time_period"], bch_eur["volatility_mid_3min"], label = "mid_vol")
-axs[1, 0].plot(bch_eur["time_period"], bch_eur["volatility_last_3min"], label = "last_vol")
-axs[1, 0].legend()
-axs[1, 0].set(xlabel='period', ylabel='BCH-EUR 3 min Volatility')
+    :param market_data: minute level aggregated market information keyed by pair
+    :type market_data: dict
+    :param figure_dir: directory the png files are saved to
+    :type figure_dir: str
+    :param figures: midpoint and last price volatility columns and label keyed by file name, see VOL_FIGURES
+    :type figures: dict
+    :param pairs: four pair names of two currencies, row by row
+    :type pairs: list
+    :param max_workers: number of worker processes, None for the number of cpus, 1 to render in this process
+    :type max_workers: int
+    :return: paths of the saved figures keyed by file name
+    :rtype: dict
+    """
+    matplotlib.use("Agg")
+    os.makedirs(figure_dir, exist_ok=True)
+    jobs = {}
+    for name, (mid_column, last_column, label) in figures.items():
+        plot_data = {pair: market_data[pair][["time_period", mid_column, last_column]] for pair in pairs}
+        jobs[name] = (plot_data, mid_column, last_column, label, os.path.join(figure_dir, name + ".png"), pairs)
+    if max_workers == 1 or len(jobs) <= 1:
+        return {name: plot_volatility(*job) for name, job in jobs.items()}
+    # workers started without forking this process do not inherit the backend
+    with ProcessPoolExecutor(max_workers, initializer=matplotlib.use, initargs=("Agg",)) as executor:
+        futures = {name: executor.submit(plot_volatility, *job) for name, job in jobs.items()}
+        return {name: future.result() for name, future in futures.items()}
 
-axs[1, 1].plot(bch_btc["time_period"], bch_btc["volatility_mid_3min"], label = "mid_vol")
-axs[1, 1].plot(bch_btc["time_period"], bch_btc["volatility_last_3min"], label = "last_vol")
-axs[1, 1].legend()
-axs[1, 1].set(xlabel='period', ylabel='BCH-BTC 3 min Volatility')
 
-plt.savefig('./figure_output/3min_vol.png', dpi=fig.dpi)
-plt.show()
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Plot the 1 min and 3 min volatility of the aggregated market data.")
+    parser.add_argument("--data-dir", default="./data_output", help="directory of the csv files of each pair")
+    parser.add_argument("--figure-dir", default="./figure_output", help="directory the png figures are saved to")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes rendering the figures")
+    args = parser.parse_args()
+    # render to files without a display
+    matplotlib.use("Agg")
+    render_figures(load_market_data(args.data_dir), args.figure_dir, max_workers=args.workers)